@@ -0,0 +1,351 @@
+"""Drives simulated students through the full OSCE flow and reports latency and load.
+
+Each simulated student runs the real app script headlessly with Streamlit's
+AppTest: API key entry, scenario selection, Start Encounter, a number of chat
+turns mixed with exam/lab/referral clicks, then the assessment and feedback.
+All LLM calls go to a local mock Groq server, so the benchmark runs offline.
+
+    python benchmarks/load_test.py --concurrency 1 5 10 20 --turns 6
+
+Results are saved as JSON under benchmarks/results/ and can be compared with an
+earlier run using --compare.
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+APP_PATH = BENCHMARK_DIR.parent / "streamlit_osce_app.py"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+QUESTIONS = [
+    "Hello, what brings you in today?",
+    "When did you first notice the ulcer?",
+    "Has it been draining any fluid?",
+    "Do you have any pain in your legs when you walk?",
+    "Do you have fevers or chills?",
+    "Any numbness or tingling in your feet?",
+    "Do you smoke?",
+    "How much alcohol do you drink?",
+    "What medications are you taking?",
+    "Are you taking all of your medications as prescribed?",
+    "What other medical problems do you have?",
+    "Any family history of heart disease or stroke?",
+    "Who do you live with at home?",
+    "Have you been short of breath?",
+]
+
+DDX = """1. Mixed arterial-venous leg ulcer - edema, claudication, ABI 0.6, monophasic doppler
+2. Venous stasis ulcer - hemosiderin staining, CHF
+3. Arterial insufficiency ulcer - nonpalpable pulses, smoker
+4. Diabetic ulcer"""
+
+PLAN = (
+    "Autolytic debridement with moist dressings and reduced compression given PAD. "
+    "Refer to cardiology, podiatry, wound care, home health and social work. "
+    "Address non-adherence to furosemide and lisinopril. Smoking cessation."
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(args):
+    """Starts the mock Groq server in its own process so it does not skew app CPU."""
+    port = free_port()
+    command = [
+        sys.executable, str(BENCHMARK_DIR / "mock_groq_server.py"), "--port", str(port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate), "--stream-error-rate", str(args.stream_error_rate),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()  # Wait until it is listening
+    return process, f"http://127.0.0.1:{port}"
+
+
+def enable_concurrent_app_tests():
+    """Lets many AppTest sessions run at once in this process, like a real server.
+
+    AppTest installs a mock Streamlit runtime at the start of every run and
+    removes it at the end, which breaks any other session running concurrently.
+    This installs one shared mock runtime instead and keeps AppTest's per-run
+    setup and teardown away from it. The compiled script is shared as well, as
+    it is on a real server.
+    """
+    from contextlib import nullcontext
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+    class PerRunRuntime:
+        _instance = None
+
+    app_test.Runtime = PerRunRuntime
+    script_cache = ScriptCache()
+    script_cache.get_bytecode(str(APP_PATH))  # Compile once up front, not in every session thread
+    app_test.ScriptCache = lambda: script_cache
+    local_script_runner.ScriptCache = lambda: script_cache
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda options: nullcontext()
+
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of values using the nearest-rank method."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def current_rss_bytes():
+    """Returns the resident memory of this process (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def session_state_bytes(app):
+    """Approximates the memory one session keeps in st.session_state."""
+    total = 0
+    state = app.session_state._state
+    for key in state.filtered_state:
+        try:
+            total += len(pickle.dumps(state[key]))
+        except Exception:
+            pass  # Clients and other unpicklable resources are shared, not per-session
+    return total
+
+
+def button(app, label=None, key=None):
+    for widget in app.button:
+        if (key is not None and widget.key == key) or (label is not None and widget.label == label):
+            return widget
+    raise LookupError(f"No button {label or key} on page '{app.session_state.page}'")
+
+
+def timed_run(widget_action, timings, name):
+    start = time.perf_counter()
+    app = widget_action.run()
+    timings.setdefault(name, []).append(time.perf_counter() - start)
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    return app
+
+
+def simulate_student(student_id, args, timings, lock):
+    """Runs one student through the whole encounter and records step timings."""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed + student_id)
+    local = {}
+    app = AppTest.from_file(str(APP_PATH), default_timeout=args.timeout).run()
+
+    app.text_input[0].input("gsk_benchmark")
+    app.text_input[1].input(f"benchmark-{student_id}")
+    app = timed_run(button(app, label="Validate and Continue").click(), local, "api_key_entry")
+    scenario_key = next(widget.key for widget in app.button if (widget.key or "").startswith("scenario_"))
+    app = timed_run(button(app, key=scenario_key).click(), local, "scenario_selection")
+    app = timed_run(button(app, label="Start Encounter").click(), local, "start_encounter")
+
+    scenario = app.session_state.current_scenario
+    actions = [
+        (prefix, action)
+        for prefix, category in (("exam", "physical_exam"), ("lab", "lab_results"), ("ref", "referrals"))
+        for action in scenario[category]
+    ]
+    questions = rng.sample(QUESTIONS, min(args.turns, len(QUESTIONS)))
+    for question in questions:
+        app = timed_run(app.chat_input[0].set_value(question), local, "chat_turn")
+        for _ in range(args.actions_per_turn):
+            prefix, action = rng.choice(actions)
+            app = timed_run(button(app, key=f"{prefix}_{action}").click(), local, "action")
+
+    app = timed_run(button(app, label="End Encounter & Assess").click(), local, "end_encounter")
+    app.text_area[0].input(DDX)
+    app.text_area[1].input(PLAN)
+    app = timed_run(app.button[0].click(), local, "feedback")
+
+    ttft = [m["time_to_first_token"] for m in app.session_state.turn_metrics
+            if m["time_to_first_token"] is not None and not m["cached"]]
+    local["time_to_first_token"] = ttft
+    local["session_state_bytes"] = [session_state_bytes(app)]
+    with lock:
+        for name, values in local.items():
+            timings.setdefault(name, []).extend(values)
+
+
+def run_level(concurrency, args):
+    """Runs one concurrency level and returns its latency and resource report."""
+    timings = {}
+    lock = threading.Lock()
+    sessions = concurrency * args.sessions_per_worker
+    failures = []
+
+    rss_before = current_rss_bytes()
+    cpu_before = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(simulate_student, i, args, timings, lock) for i in range(sessions)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(repr(e))
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_before
+    rss_after = current_rss_bytes()
+
+    completed = sessions - len(failures)
+    turns = len(timings.get("chat_turn", []))
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "completed": completed,
+        "failures": failures[:10],
+        "wall_time_s": wall_time,
+        "throughput_sessions_per_s": completed / wall_time,
+        "throughput_turns_per_s": turns / wall_time,
+        "cpu_s_per_session": cpu_time / max(completed, 1),
+        "cpu_utilization": cpu_time / wall_time,
+        "rss_growth_bytes_per_session": (rss_after - rss_before) / max(completed, 1),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "session_state_bytes": summarize(timings.pop("session_state_bytes", [])),
+        "latency_s": {name: summarize(values) for name, values in sorted(timings.items())},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_PATH.parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result, baseline=None):
+    """Prints a compact table of the results, with deltas against a baseline run."""
+    baseline_levels = {level["concurrency"]: level for level in (baseline or {}).get("levels", [])}
+
+    def fmt(value, base=None, scale=1000, unit="ms"):
+        if value is None:
+            return "-"
+        text = f"{value * scale:.0f}{unit}"
+        if base is not None:
+            text += f" ({(value - base) * scale:+.0f})"
+        return text
+
+    for level in result["levels"]:
+        base = baseline_levels.get(level["concurrency"], {})
+        print(f"\n== concurrency {level['concurrency']}: {level['completed']}/{level['sessions']} sessions, "
+              f"{level['throughput_sessions_per_s']:.2f} sessions/s, {level['throughput_turns_per_s']:.2f} turns/s, "
+              f"{level['cpu_s_per_session'] * 1000:.0f}ms CPU/session, "
+              f"{level['rss_growth_bytes_per_session'] / 1024:.0f}KiB RSS/session")
+        for name, stats in level["latency_s"].items():
+            base_stats = base.get("latency_s", {}).get(name, {})
+            print(f"   {name:<20} n={stats['count']:<5} "
+                  f"p50={fmt(stats['p50'], base_stats.get('p50')):<16} "
+                  f"p95={fmt(stats['p95'], base_stats.get('p95')):<16} "
+                  f"p99={fmt(stats['p99'], base_stats.get('p99'))}")
+        for failure in level["failures"]:
+            print(f"   failure: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 20],
+                        help="Concurrent simulated students for each level.")
+    parser.add_argument("--sessions-per-worker", type=int, default=2, help="Encounters each concurrent student runs.")
+    parser.add_argument("--turns", type=int, default=6, help="Chat turns per encounter.")
+    parser.add_argument("--actions-per-turn", type=int, default=1, help="Exam/lab/referral clicks after each turn.")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock first-token latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--base-url", help="Use an already running Groq-compatible server instead of the mock.")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed for a single app rerun.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Where to save the results (default: benchmarks/results/).")
+    parser.add_argument("--compare", type=Path, help="A previous results file to compare against.")
+    args = parser.parse_args()
+
+    mock = None
+    base_url = args.base_url
+    if base_url is None:
+        mock, base_url = start_mock_server(args)
+    os.environ["GROQ_BASE_URL"] = base_url
+    # Keep benchmark encounters out of the real encounter database
+    database_dir = tempfile.TemporaryDirectory()
+    os.environ["OSCE_DB"] = str(Path(database_dir.name) / "encounters.db")
+    enable_concurrent_app_tests()
+
+    try:
+        levels = []
+        for concurrency in args.concurrency:
+            print(f"Running {concurrency * args.sessions_per_worker} sessions at concurrency {concurrency}...", flush=True)
+            levels.append(run_level(concurrency, args))
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+        database_dir.cleanup()
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "settings": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "levels": levels,
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(result, baseline)
+
+    output = args.output or RESULTS_DIR / f"{result['timestamp'].replace(':', '')}_{result['git_revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
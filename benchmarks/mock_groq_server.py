@@ -0,0 +1,231 @@
+"""A local Groq-compatible chat completions server for offline load testing.
+
+Serves the subset of the Groq (OpenAI-compatible) API the simulator uses, with
+configurable latency, token rate and error injection. Point the app at it with
+
+    GROQ_BASE_URL=http://127.0.0.1:8808 streamlit run streamlit_osce_app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELS = ["llama3-8b-8192", "llama3-70b-8192"]
+
+PATIENT_REPLIES = [
+    "Hello doctor. I'm here because of this blister on my leg, it just won't heal.",
+    "It started about ten days ago, and it's been draining a bit of fluid the last few days.",
+    "Yes, my legs hurt when I walk, especially on the stairs, but it gets better when I rest.",
+    "I've been smoking for most of my life, I'm afraid. About a pack a day.",
+    "I take a few pills for my heart and my sugar, but I'm not sure of all the names.",
+    "No fevers or chills, but the area feels warm and it's tender if I touch it.",
+    "I'm not sure, doctor.",
+]
+
+FEEDBACK_REPLY = (
+    "The student identified several of the expected diagnoses and supported them with relevant "
+    "findings from the history and examination. The reasoning could be strengthened by citing the "
+    "ankle-brachial index and the venous duplex results explicitly. The plan addresses wound care "
+    "and referrals, but should state that compression must be modified because of the arterial "
+    "disease, and should address medication adherence and home support. "
+)
+
+
+class MockSettings:
+    """Latency, throughput and failure settings shared by all request handlers."""
+
+    def __init__(self, latency=0.3, jitter=0.1, tokens_per_second=200.0, error_rate=0.0,
+                 rate_limit_rate=0.0, stream_error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_error_rate = stream_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "rate_limited": 0, "stream_errors": 0}
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def first_token_delay(self):
+        with self.lock:
+            return max(0.0, self.random.gauss(self.latency, self.jitter))
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+
+def approximate_tokens(text):
+    """Approximates the token count of text at about four characters per token."""
+    return max(1, len(text) // 4)
+
+
+def reply_tokens(messages, max_tokens):
+    """Picks a canned reply for the prompt and splits it into word tokens."""
+    prompt = " ".join(str(message.get("content", "")) for message in messages)
+    if "OSCE examiner" in prompt:
+        text = FEEDBACK_REPLY * 4
+    else:
+        text = PATIENT_REPLIES[len(prompt) % len(PATIENT_REPLIES)]
+    words = text.split()
+    return [word + " " for word in words[:max_tokens]]
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    """Handles the models and chat completions endpoints."""
+
+    protocol_version = "HTTP/1.1"
+    settings = MockSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, error_type, message, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path.endswith("/models"):
+            data = [{"id": model, "object": "model", "created": 0, "owned_by": "mock"} for model in MODELS]
+            self.send_json(200, {"object": "list", "data": data})
+        elif "/models/" in path and path.rsplit("/", 1)[1] in MODELS:
+            self.send_json(200, {"id": path.rsplit("/", 1)[1], "object": "model", "created": 0, "owned_by": "mock"})
+        else:
+            self.send_error_json(404, "not_found", f"Unknown path {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error_json(404, "not_found", f"Unknown path {self.path}")
+            return
+
+        settings = self.settings
+        settings.count("requests")
+        if settings.roll(settings.rate_limit_rate):
+            settings.count("rate_limited")
+            self.send_error_json(429, "rate_limit_exceeded", "Rate limit reached (mock).", {"retry-after": "1"})
+            return
+        if settings.roll(settings.error_rate):
+            settings.count("errors")
+            self.send_error_json(500, "internal_server_error", "Injected server error (mock).")
+            return
+
+        messages = request.get("messages", [])
+        tokens = reply_tokens(messages, request.get("max_tokens") or 1024)
+        usage = {
+            "prompt_tokens": approximate_tokens(json.dumps(messages)),
+            "completion_tokens": len(tokens),
+            "total_tokens": approximate_tokens(json.dumps(messages)) + len(tokens),
+        }
+        time.sleep(settings.first_token_delay())
+        if request.get("stream"):
+            self.stream_completion(request["model"], tokens, usage)
+        else:
+            time.sleep(len(tokens) / settings.tokens_per_second)
+            self.send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def stream_completion(self, model, tokens, usage):
+        """Streams tokens as server-sent events at the configured token rate."""
+        settings = self.settings
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        fail_at = settings.random.randrange(len(tokens)) if settings.roll(settings.stream_error_rate) else None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta, finish_reason=None, extra=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **(extra or {}),
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            send_chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i == fail_at:
+                    # Drop the connection to simulate a failure mid-stream
+                    settings.count("stream_errors")
+                    return
+                send_chunk({"content": token})
+                time.sleep(1 / settings.tokens_per_second)
+            send_chunk({}, "stop", {"x_groq": {"id": completion_id, "usage": usage}})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def create_server(host="127.0.0.1", port=8808, settings=None):
+    """Creates a threaded mock server; call serve_forever() to start it."""
+    handler = type("ConfiguredMockGroqHandler", (MockGroqHandler,), {"settings": settings or MockSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.3, help="Mean seconds before the first token.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Standard deviation of the first-token latency.")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Token generation rate per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with a 429.")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="Share of streams dropped mid-reply.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.jitter, args.tokens_per_second, args.error_rate,
+                            args.rate_limit_rate, args.stream_error_rate, args.seed)
+    server = create_server(args.host, args.port, settings)
+    print(f"Mock Groq server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served: {json.dumps(settings.counts)}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Reports the compiled prompt templates of every scenario and their token counts.
+
+For each scenario in the index, lists the patient and examiner prompt
+templates with the fingerprint and approximate token count of their static
+prefix, and how many tokens the examiner prefixes have in common. Requests
+with the same prefix fingerprint can be served from the provider's prefix
+cache.
+
+    python benchmarks/prompt_report.py
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import streamlit.logger
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+
+# The app's caches warn about the missing Streamlit server for every function
+streamlit.logger.set_log_level("error")
+import streamlit_osce_app as app
+
+
+def scenario_report(scenario_id):
+    """Returns the template rows and the shared examiner prefix tokens of one scenario."""
+    prompts = app.get_scenario_prompts(scenario_id)
+    rows = [
+        {"template": name, "fingerprint": template.fingerprint, "prefix_tokens": template.prefix_tokens}
+        for name, template in prompts.items()
+    ]
+    shared = os.path.commonprefix([prompts[title].prefix for title in app.FEEDBACK_SECTIONS])
+    return rows, app.count_tokens(shared)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON instead of a table.")
+    args = parser.parse_args()
+
+    report = []
+    for entry in app.load_scenario_index():
+        rows, shared_tokens = scenario_report(entry["id"])
+        report.append({"scenario": entry["id"], "templates": rows, "shared_examiner_prefix_tokens": shared_tokens})
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for scenario in report:
+        print(f"\n{scenario['scenario']}")
+        for row in scenario["templates"]:
+            print(f"   {row['template']:<45} {row['fingerprint']}  {row['prefix_tokens']:>6} tokens")
+        print(f"   {'(shared by the examiner prompts)':<45} {'':16}  {scenario['shared_examiner_prefix_tokens']:>6} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""The encounter event log and the cohort analytics counters, kept in SQLite."""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+# --- CONFIGURATION ---
+ENCOUNTER_DB_FILE = os.environ.get("OSCE_DB", str(Path(__file__).parent / "data" / "encounters.db"))
+ENCOUNTER_WRITE_BATCH = 200  # Max encounter events committed in one transaction
+ENCOUNTER_WRITE_INTERVAL = 0.25  # Seconds the writer waits to gather more events into a batch
+
+class EncounterStore:
+    """Keeps an append-only log of encounter events in SQLite.
+
+    Writes are queued and committed in batches by a background thread, so
+    recording an event never makes the UI wait on the disk. Completed
+    encounters are also added to daily counters per scenario and cohort, so
+    analytics never have to read the event log.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS encounters (
+            encounter_id TEXT PRIMARY KEY,
+            student_id TEXT NOT NULL,
+            cohort TEXT NOT NULL DEFAULT '',
+            scenario_id TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            status TEXT NOT NULL,
+            resume_token TEXT
+        );
+        CREATE INDEX IF NOT EXISTS encounters_by_student ON encounters (student_id, started_at);
+        CREATE INDEX IF NOT EXISTS encounters_by_scenario ON encounters (scenario_id, started_at);
+        CREATE INDEX IF NOT EXISTS encounters_by_date ON encounters (started_at);
+        CREATE TABLE IF NOT EXISTS encounter_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            encounter_id TEXT NOT NULL REFERENCES encounters (encounter_id),
+            created_at REAL NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_by_encounter ON encounter_events (encounter_id, event_id);
+        CREATE TABLE IF NOT EXISTS encounter_stats (
+            scenario_id TEXT NOT NULL,
+            cohort TEXT NOT NULL,
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            item TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total_seconds REAL NOT NULL,
+            PRIMARY KEY (scenario_id, cohort, day, metric, item)
+        );
+    """
+
+    # Counts one completed encounter towards a counter, unless it was already counted
+    STATS_UPSERT = """
+        INSERT INTO encounter_stats (scenario_id, cohort, day, metric, item, count, total_seconds)
+        SELECT scenario_id, cohort, date(started_at, 'unixepoch', 'localtime'), ?, ?, 1, ?
+        FROM encounters WHERE encounter_id = ? AND status != 'completed'
+        ON CONFLICT (scenario_id, cohort, day, metric, item)
+        DO UPDATE SET count = count + 1, total_seconds = total_seconds + excluded.total_seconds
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        Path(db_file).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+            # Databases created before cohorts were recorded
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(encounters)")}
+            if "cohort" not in columns:
+                connection.execute("ALTER TABLE encounters ADD COLUMN cohort TEXT NOT NULL DEFAULT ''")
+            # and before resume tokens; their encounters can no longer be resumed
+            if "resume_token" not in columns:
+                connection.execute("ALTER TABLE encounters ADD COLUMN resume_token TEXT")
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, name="encounter-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_file, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def open_encounter(self, encounter_id, student_id, cohort, scenario_id, started_at, resume_token):
+        """Logs a new encounter, abandoning the student's other unfinished ones.
+
+        The encounter can only be resumed with its resume token.
+        """
+        self.pending.put((
+            "UPDATE encounters SET status = 'abandoned', updated_at = ? WHERE student_id = ? AND status NOT IN ('completed', 'abandoned')",
+            (started_at, student_id),
+        ))
+        self.pending.put((
+            "INSERT INTO encounters (encounter_id, student_id, cohort, scenario_id, started_at, updated_at, status, resume_token) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'active', ?)",
+            (encounter_id, student_id, cohort, scenario_id, started_at, started_at, resume_token),
+        ))
+        self.append_event(encounter_id, "started", {"start_time": started_at})
+
+    def append_event(self, encounter_id, kind, payload):
+        self.pending.put((
+            "INSERT INTO encounter_events (encounter_id, created_at, kind, payload) VALUES (?, ?, ?, ?)",
+            (encounter_id, time.time(), kind, json.dumps(payload)),
+        ))
+
+    def set_status(self, encounter_id, status):
+        self.pending.put((
+            "UPDATE encounters SET status = ?, updated_at = ? WHERE encounter_id = ?",
+            (status, time.time(), encounter_id),
+        ))
+
+    def record_completion(self, encounter_id, action_times, diagnoses_named):
+        """Adds an encounter to the analytics counters; queue it before marking the encounter completed.
+
+        action_times maps each action performed to the seconds from the start
+        of the encounter until it was first performed.
+        """
+        stats = [("encounters", "", 0.0)]
+        stats += [("action", action, seconds) for action, seconds in action_times.items()]
+        stats += [("diagnosis", diagnosis, 0.0) for diagnosis in diagnoses_named]
+        for metric, item, seconds in stats:
+            self.pending.put((self.STATS_UPSERT, (metric, item, seconds, encounter_id)))
+
+    def cohort_stats(self, scenario_id=None, cohort=None, since=None, until=None):
+        """Sums the analytics counters per scenario over a cohort and an inclusive range of YYYY-MM-DD days.
+
+        Returns (scenario_id, metric, item, count, total_seconds) rows.
+        """
+        conditions, params = [], []
+        for column, operator, value in (
+            ("scenario_id", "=", scenario_id), ("cohort", "=", cohort),
+            ("day", ">=", since), ("day", "<=", until),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT scenario_id, metric, item, SUM(count) AS count, SUM(total_seconds) AS total_seconds "
+                f"FROM encounter_stats {where} GROUP BY scenario_id, metric, item",
+                params,
+            ).fetchall()
+
+    def list_cohorts(self):
+        """Returns the cohorts with completed encounters."""
+        with closing(self._connect()) as connection:
+            return [row["cohort"] for row in connection.execute("SELECT DISTINCT cohort FROM encounter_stats ORDER BY cohort")]
+
+    def find_open_encounter(self, student_id, resume_token):
+        """Returns the student's latest unfinished encounter row opened with resume_token, or None."""
+        if not resume_token:
+            return None
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT * FROM encounters WHERE student_id = ? AND resume_token = ? "
+                "AND status NOT IN ('completed', 'abandoned') ORDER BY started_at DESC LIMIT 1",
+                (student_id, resume_token),
+            ).fetchone()
+
+    def find_encounters(self, student_id=None, scenario_id=None, since=None, until=None):
+        """Returns the encounter rows matching the given student, scenario and date range."""
+        conditions, params = [], []
+        for column, operator, value in (
+            ("student_id", "=", student_id), ("scenario_id", "=", scenario_id),
+            ("started_at", ">=", since), ("started_at", "<", until),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self._connect()) as connection:
+            return connection.execute(f"SELECT * FROM encounters {where} ORDER BY started_at", params).fetchall()
+
+    def load_events(self, encounter_id):
+        """Returns an encounter's (kind, payload) events in the order they happened."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT kind, payload FROM encounter_events WHERE encounter_id = ? ORDER BY event_id",
+                (encounter_id,),
+            ).fetchall()
+        return [(row["kind"], json.loads(row["payload"])) for row in rows]
+
+    def flush(self):
+        """Blocks until every queued write has been committed."""
+        self.pending.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join()
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            batch = [self.pending.get()]
+            flush_at = time.monotonic() + ENCOUNTER_WRITE_INTERVAL
+            while batch[-1] is not None and len(batch) < ENCOUNTER_WRITE_BATCH:
+                try:
+                    batch.append(self.pending.get(timeout=max(0, flush_at - time.monotonic())))
+                except queue.Empty:
+                    break
+            writes = [item for item in batch if item is not None]
+            try:
+                with connection:
+                    for statement, params in writes:
+                        connection.execute(statement, params)
+            except sqlite3.Error:
+                logging.getLogger(__name__).exception("Could not save %d encounter events", len(writes))
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+            if batch[-1] is None:
+                connection.close()
+                return
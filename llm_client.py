@@ -0,0 +1,484 @@
+"""LLM backends and the instrumented calls made to them.
+
+Requests are admitted within each backend's rate limits, routed to the model
+tier for their purpose, and retried with backoff until their deadline.
+"""
+import streamlit as st
+import asyncio
+from abc import ABC, abstractmethod
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+import httpx
+from groq import APIConnectionError, AsyncGroq, AsyncStream, Groq, InternalServerError, RateLimitError, Stream
+from groq.types.chat import ChatCompletion, ChatCompletionChunk
+
+from llm_telemetry import get_llm_telemetry
+
+# --- CONFIGURATION ---
+MESSAGE_TOKEN_OVERHEAD = 4  # Role and separator tokens added per chat message
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+LLM_FAST_MODEL = os.environ.get("OSCE_FAST_MODEL", "llama3-8b-8192")  # Groq model for the fast tier
+LLM_STRONG_MODEL = os.environ.get("OSCE_STRONG_MODEL", "llama3-70b-8192")  # Groq model for the strong tier
+LLM_PURPOSE_TIERS = {  # Model tiers per purpose; later tiers are fallbacks when earlier ones are overloaded
+    "patient": ("fast", "strong"),
+    "greeting": ("fast", "strong"),
+    "feedback": ("strong", "fast"),
+    "regrade": ("strong", "fast"),
+}
+LLM_FALLBACK_WAIT = 2  # Seconds a request queues for a busy route before trying the next one
+LOCAL_LLM_URL = os.environ.get("OSCE_LOCAL_LLM_URL", "")  # e.g. http://127.0.0.1:8080 for llama.cpp; adds it to the fast tier
+LOCAL_LLM_MODEL = os.environ.get("OSCE_LOCAL_LLM_MODEL", "local")
+LOCAL_LLM_API_KEY = os.environ.get("OSCE_LOCAL_LLM_API_KEY", "none")  # Most local servers ignore it
+LOCAL_LLM_CHAT_PATH = "/v1/chat/completions"
+LOCAL_LLM_MODELS_PATH = "/v1/models"
+LOCAL_LLM_REQUESTS_PER_MINUTE = int(os.environ.get("OSCE_LOCAL_RPM", "600"))
+LOCAL_LLM_TOKENS_PER_MINUTE = int(os.environ.get("OSCE_LOCAL_TPM", "1000000"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("OSCE_LLM_CONNECT_TIMEOUT", "5"))  # Seconds to open a connection to the API
+LLM_READ_TIMEOUT = float(os.environ.get("OSCE_LLM_READ_TIMEOUT", "60"))  # Max seconds between bytes of a reply
+LLM_MAX_CONNECTIONS = 100  # Open connections per API key, shared by all sessions
+LLM_KEEPALIVE_CONNECTIONS = 20  # Idle connections kept open per API key
+LLM_KEEPALIVE_EXPIRY = 60  # Seconds an idle connection is kept open
+API_KEY_VALIDATION_TTL = 15 * 60  # Seconds a successful key check is reused
+LLM_MAX_RETRIES = 4  # Retries for rate-limited, failed or unreachable LLM requests
+LLM_RETRY_BASE_DELAY = 0.5  # Max seconds before the first retry, doubled for each later one
+LLM_RETRY_MAX_DELAY = 8  # Cap on the backoff between retries
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("OSCE_GROQ_RPM", "300"))  # Match the Groq account's limits
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("OSCE_GROQ_TPM", "100000"))
+LLM_PRIORITIES = {"patient": 0, "key_validation": 0, "greeting": 1, "feedback": 1, "regrade": 2}  # Lower numbers are sent first
+LLM_DEADLINES = {"patient": 30, "key_validation": 15, "greeting": 60, "feedback": 180, "regrade": 600}  # Seconds per call, queueing and retries included
+LLM_MODEL_PRICES = {  # USD per million prompt and completion tokens
+    "llama3-8b-8192": (0.05, 0.08),
+    "llama3-70b-8192": (0.59, 0.79),
+}
+
+RETRYABLE_LLM_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+def count_tokens(text):
+    """Approximates the number of Llama 3 tokens in a piece of text."""
+    pieces = TOKEN_PATTERN.findall(text)
+    # Long words are split into several sub-word tokens by the tokenizer
+    return sum(1 + len(piece) // 6 for piece in pieces)
+
+def count_message_tokens(messages):
+    """Approximates the prompt tokens for a list of chat messages."""
+    return sum(count_tokens(msg["content"]) + MESSAGE_TOKEN_OVERHEAD for msg in messages)
+
+class LLMScheduler:
+    """Admits the LLM requests sent to one backend within its rate limits.
+
+    Two continuously refilled token buckets hold the requests and tokens left
+    this minute. Waiting requests queue by priority, so patient turns go ahead
+    of feedback jobs, and give up at their deadline.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.condition = threading.Condition()
+        self.request_limit = requests_per_minute
+        self.token_limit = tokens_per_minute
+        self.request_budget = float(requests_per_minute)
+        self.token_budget = float(tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = []  # Heap of (priority, arrival) tickets
+        self.arrivals = itertools.count()
+
+    def acquire(self, priority, tokens, deadline):
+        """Blocks until a request may be sent and returns the seconds waited.
+
+        Raises TimeoutError if the deadline (a time.monotonic() value) passes first.
+        """
+        tokens = min(tokens, self.token_limit)
+        ticket = (priority, next(self.arrivals))
+        start = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._wait_time(now, tokens) if self.waiting[0] == ticket else None
+                    if wait == 0:
+                        heapq.heappop(self.waiting)
+                        self.request_budget -= 1
+                        self.token_budget -= tokens
+                        self.condition.notify_all()
+                        return now - start
+                    if now >= deadline:
+                        raise TimeoutError("Timed out waiting for the API rate limit.")
+                    self.condition.wait(min(wait or deadline - now, deadline - now))
+            except BaseException:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self.condition.notify_all()
+                raise
+
+    def pause(self, seconds):
+        """Holds back every request on the key, e.g. after a 429."""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now):
+        elapsed = now - self.refilled_at
+        self.refilled_at = now
+        self.request_budget = min(self.request_limit, self.request_budget + elapsed * self.request_limit / 60)
+        self.token_budget = min(self.token_limit, self.token_budget + elapsed * self.token_limit / 60)
+
+    def _wait_time(self, now, tokens):
+        """Returns the seconds until both buckets can cover the request."""
+        wait = max(0.0, self.paused_until - now)
+        if self.request_budget < 1:
+            wait = max(wait, (1 - self.request_budget) * 60 / self.request_limit)
+        if self.token_budget < tokens:
+            wait = max(wait, (tokens - self.token_budget) * 60 / self.token_limit)
+        return wait
+
+def api_key_digest(api_key):
+    """Identifies an API key in caches without keeping the key itself as a cache key."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def create_http_client(async_client=False):
+    """Creates a pooled HTTP client with keep-alive and the configured timeouts."""
+    client_class = httpx.AsyncClient if async_client else httpx.Client
+    return client_class(
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+class LLMBackend(ABC):
+    """A chat completions API, with sync, streaming and async calls.
+
+    Each backend has its own scheduler, so it is rate limited on its own.
+    Retries are made, and counted, by create_with_retries, so the SDK's own
+    are off. The async client is meant for a single long-lived event loop.
+    """
+
+    name = None
+
+    def __init__(self, client, async_client, scheduler):
+        self.client = client
+        self.async_client = async_client
+        self.scheduler = scheduler
+
+    @abstractmethod
+    def create(self, request, timeout):
+        """Returns a ChatCompletion, or a stream of chunks if request["stream"] is set."""
+
+    @abstractmethod
+    async def acreate(self, request, timeout):
+        """Async version of create()."""
+
+    @abstractmethod
+    def list_models(self):
+        """Returns the IDs of the models served; used to check the credentials without generating anything."""
+
+class GroqBackend(LLMBackend):
+    """Models hosted by Groq, reached with one API key."""
+
+    name = "groq"
+
+    def __init__(self, api_key):
+        super().__init__(
+            Groq(api_key=api_key, http_client=create_http_client(), max_retries=0),
+            AsyncGroq(api_key=api_key, http_client=create_http_client(async_client=True), max_retries=0),
+            LLMScheduler(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE),
+        )
+
+    def create(self, request, timeout):
+        return self.client.chat.completions.create(**request, timeout=timeout)
+
+    async def acreate(self, request, timeout):
+        return await self.async_client.chat.completions.create(**request, timeout=timeout)
+
+    def list_models(self):
+        return [model.id for model in self.client.models.list().data]
+
+class LocalBackend(LLMBackend):
+    """A local OpenAI-compatible server, such as llama.cpp or vLLM.
+
+    These serve chat completions under /v1 rather than Groq's /openai/v1, so
+    requests are posted to that path with the same SDK, errors and types.
+    """
+
+    name = "local"
+
+    def __init__(self, base_url):
+        super().__init__(
+            Groq(api_key=LOCAL_LLM_API_KEY, base_url=base_url, http_client=create_http_client(), max_retries=0),
+            AsyncGroq(api_key=LOCAL_LLM_API_KEY, base_url=base_url, http_client=create_http_client(async_client=True), max_retries=0),
+            LLMScheduler(LOCAL_LLM_REQUESTS_PER_MINUTE, LOCAL_LLM_TOKENS_PER_MINUTE),
+        )
+
+    def create(self, request, timeout):
+        return self.client.post(
+            LOCAL_LLM_CHAT_PATH, cast_to=ChatCompletion, body=request, options={"timeout": timeout},
+            stream=bool(request.get("stream")), stream_cls=Stream[ChatCompletionChunk],
+        )
+
+    async def acreate(self, request, timeout):
+        return await self.async_client.post(
+            LOCAL_LLM_CHAT_PATH, cast_to=ChatCompletion, body=request, options={"timeout": timeout},
+            stream=bool(request.get("stream")), stream_cls=AsyncStream[ChatCompletionChunk],
+        )
+
+    def list_models(self):
+        return [model["id"] for model in self.client.get(LOCAL_LLM_MODELS_PATH, cast_to=object)["data"]]
+
+@st.cache_resource
+def get_groq_backend(key_digest, _api_key):
+    """Creates the Groq backend, and its connection pools, shared by every session using a key."""
+    return GroqBackend(_api_key)
+
+@st.cache_resource
+def get_local_backend():
+    """Creates the local model backend, or returns None if no local server is configured."""
+    return LocalBackend(LOCAL_LLM_URL) if LOCAL_LLM_URL else None
+
+@st.cache_data(ttl=API_KEY_VALIDATION_TTL, show_spinner=False)
+def validate_api_key(key_digest, _backend):
+    """Checks an API key by listing the available models, without generating anything.
+
+    Only successful checks are cached; a rejected key raises the API error.
+    """
+    call = new_llm_call("key_validation")
+    call["backend"] = _backend.name
+    start = time.perf_counter()
+    try:
+        return _backend.list_models()
+    except Exception as e:
+        call["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        call["wall_time"] = time.perf_counter() - start
+        get_llm_telemetry().record(call)
+
+def llm_routes(purpose, groq_backend):
+    """Returns the (backend, model) routes for a purpose, in the order they are tried.
+
+    Patient turns go to the fast tier, served locally when a local server is
+    configured, and feedback to the strong tier; the other tier is the fallback.
+    """
+    tiers = {"fast": [], "strong": []}
+    local_backend = get_local_backend()
+    if local_backend is not None:
+        tiers["fast"].append((local_backend, LOCAL_LLM_MODEL))
+    if groq_backend is not None:
+        tiers["fast"].append((groq_backend, LLM_FAST_MODEL))
+        tiers["strong"].append((groq_backend, LLM_STRONG_MODEL))
+    return [route for tier in LLM_PURPOSE_TIERS.get(purpose, ("strong", "fast")) for route in tiers[tier]]
+
+def new_llm_call(purpose, session_id=None, scenario_id=None):
+    """Starts the telemetry record of one LLM call; the wrappers fill in the rest."""
+    return {
+        "timestamp": time.time(),
+        "purpose": purpose,
+        "session_id": session_id,
+        "scenario_id": scenario_id,
+        "backend": None,
+        "model": None,
+        "stream": False,
+        "wall_time": None,
+        "time_to_first_token": None,
+        "prompt_tokens": None,
+        "cached_prompt_tokens": None,
+        "completion_tokens": None,
+        "cost_usd": None,
+        "queue_time": 0.0,
+        "retries": 0,
+        "fallbacks": 0,
+        "error": None,
+    }
+
+def record_llm_usage(call, usage):
+    """Copies the token usage reported by the API, and its cost, into the call record."""
+    call["prompt_tokens"] = usage.prompt_tokens
+    call["completion_tokens"] = usage.completion_tokens
+    # Prompt tokens served from the provider's prefix cache, where reported
+    call["cached_prompt_tokens"] = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    prices = LLM_MODEL_PRICES.get(call["model"])
+    if prices:
+        call["cost_usd"] = (usage.prompt_tokens * prices[0] + usage.completion_tokens * prices[1]) / 1_000_000
+
+def retry_delay(attempt, error):
+    """Returns a jittered exponential backoff, or the server's Retry-After if longer."""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    try:
+        return max(delay, float(response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return delay
+
+def llm_deadline(purpose):
+    """Returns the time.monotonic() deadline for a call, queueing and retries included.
+
+    Callers that retry a broken stream compute it once and pass it to every
+    attempt, so the retries share the purpose's time budget.
+    """
+    return time.monotonic() + LLM_DEADLINES.get(purpose, 60)
+
+def request_limits(call, request, deadline=None):
+    """Returns the priority, deadline and token reservation for a request."""
+    priority = LLM_PRIORITIES.get(call["purpose"], 1)
+    if deadline is None:
+        deadline = llm_deadline(call["purpose"])
+    # The completion limit is reserved too, since usage is only known afterwards
+    tokens = count_message_tokens(request["messages"]) + request.get("max_tokens", 0)
+    return priority, deadline, tokens
+
+def route_admission_deadline(routes, index, deadline):
+    """Only the last route is waited on until the deadline; busier ones fall through sooner."""
+    if index == len(routes) - 1:
+        return deadline
+    return min(deadline, time.monotonic() + LLM_FALLBACK_WAIT)
+
+def request_timeout(deadline):
+    return httpx.Timeout(min(LLM_READ_TIMEOUT, max(1, deadline - time.monotonic())), connect=LLM_CONNECT_TIMEOUT)
+
+def create_with_retries(routes, call, request, deadline=None):
+    """Sends a chat completion request along the first route that can take it.
+
+    A route whose scheduler is backed up, or whose request fails, is skipped
+    for the next one. When every route has failed, the request is retried with
+    backoff until the call's deadline; a 429 also holds back the other
+    requests on that backend. The deadline defaults to the one for the call's
+    purpose.
+    """
+    if not routes:
+        raise ValueError("No LLM backend is configured.")
+    priority, deadline, tokens = request_limits(call, request, deadline)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        for index, (backend, model) in enumerate(routes):
+            try:
+                call["queue_time"] += backend.scheduler.acquire(priority, tokens, route_admission_deadline(routes, index, deadline))
+            except TimeoutError:
+                if index == len(routes) - 1:
+                    raise
+                call["fallbacks"] += 1
+                continue
+            call["backend"], call["model"] = backend.name, model
+            try:
+                return backend.create({**request, "model": model}, request_timeout(deadline))
+            except RETRYABLE_LLM_ERRORS as e:
+                error = e
+                if isinstance(e, RateLimitError):
+                    backend.scheduler.pause(retry_delay(attempt, e))
+                if index < len(routes) - 1:
+                    call["fallbacks"] += 1
+        delay = retry_delay(attempt, error)
+        if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            raise error
+        call["retries"] += 1
+        if not isinstance(error, RateLimitError):
+            time.sleep(delay)
+
+async def acreate_with_retries(routes, call, request, deadline=None):
+    """Async version of create_with_retries()."""
+    if not routes:
+        raise ValueError("No LLM backend is configured.")
+    priority, deadline, tokens = request_limits(call, request, deadline)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        for index, (backend, model) in enumerate(routes):
+            try:
+                call["queue_time"] += await asyncio.to_thread(
+                    backend.scheduler.acquire, priority, tokens, route_admission_deadline(routes, index, deadline),
+                )
+            except TimeoutError:
+                if index == len(routes) - 1:
+                    raise
+                call["fallbacks"] += 1
+                continue
+            call["backend"], call["model"] = backend.name, model
+            try:
+                return await backend.acreate({**request, "model": model}, request_timeout(deadline))
+            except RETRYABLE_LLM_ERRORS as e:
+                error = e
+                if isinstance(e, RateLimitError):
+                    backend.scheduler.pause(retry_delay(attempt, e))
+                if index < len(routes) - 1:
+                    call["fallbacks"] += 1
+        delay = retry_delay(attempt, error)
+        if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            raise error
+        call["retries"] += 1
+        if not isinstance(error, RateLimitError):
+            await asyncio.sleep(delay)
+
+def llm_complete(groq_backend, call, **request):
+    """Runs one instrumented, blocking chat completion and returns the reply text.
+
+    The model is chosen by routing the call's purpose, so the request has none.
+    """
+    start = time.perf_counter()
+    try:
+        completion = create_with_retries(llm_routes(call["purpose"], groq_backend), call, request)
+        if completion.usage is not None:
+            record_llm_usage(call, completion.usage)
+        return completion.choices[0].message.content
+    except Exception as e:
+        call["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        call["wall_time"] = time.perf_counter() - start
+        get_llm_telemetry().record(call)
+
+async def llm_acomplete(groq_backend, call, **request):
+    """Async version of llm_complete(), for callers running their own event loop."""
+    start = time.perf_counter()
+    try:
+        completion = await acreate_with_retries(llm_routes(call["purpose"], groq_backend), call, request)
+        if completion.usage is not None:
+            record_llm_usage(call, completion.usage)
+        return completion.choices[0].message.content
+    except Exception as e:
+        call["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        call["wall_time"] = time.perf_counter() - start
+        get_llm_telemetry().record(call)
+
+def llm_stream(groq_backend, call, deadline=None, **request):
+    """Runs one instrumented, streamed chat completion, yielding the reply's tokens.
+
+    Groq reports usage in the final chunk's x_groq field; OpenAI-compatible
+    servers put it in the chunk's usage field. A stream that breaks off after
+    the request was accepted raises ConnectionError.
+    """
+    call["stream"] = True
+    start = time.perf_counter()
+    try:
+        stream = create_with_retries(llm_routes(call["purpose"], groq_backend), call, {**request, "stream": True}, deadline)
+        finished = False
+        try:
+            for chunk in stream:
+                x_groq = getattr(chunk, "x_groq", None)
+                usage = getattr(x_groq, "usage", None) or getattr(chunk, "usage", None)
+                if usage is not None:
+                    record_llm_usage(call, usage)
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].finish_reason:
+                    finished = True
+                if chunk.choices[0].delta.content:
+                    if call["time_to_first_token"] is None:
+                        call["time_to_first_token"] = time.perf_counter() - start
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise ConnectionError(f"The reply stream was interrupted: {e}") from e
+        if not finished:
+            raise ConnectionError("The reply stream ended before the reply was complete.")
+    except Exception as e:
+        call["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        call["wall_time"] = time.perf_counter() - start
+        get_llm_telemetry().record(call)
@@ -0,0 +1,135 @@
+"""Metrics and a JSON log line for every LLM call, with an optional Prometheus endpoint."""
+import streamlit as st
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+# --- CONFIGURATION ---
+LLM_LOG_FILE = os.environ.get("OSCE_LLM_LOG", str(Path(__file__).parent / "logs" / "llm_calls.jsonl"))  # Empty disables the log
+LLM_LOG_MAX_BYTES = 10 * 1024 * 1024  # Size at which the LLM call log is rotated
+LLM_LOG_BACKUP_COUNT = 5  # Rotated LLM call logs kept
+LLM_METRICS_HOST = os.environ.get("OSCE_METRICS_HOST", "127.0.0.1")
+LLM_METRICS_PORT = int(os.environ.get("OSCE_METRICS_PORT", "0"))  # Serves Prometheus metrics on /metrics when set
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+
+class LLMTelemetry:
+    """Process-wide metrics for every LLM call, plus one JSON log line per call.
+
+    Recording a call only updates in-memory aggregates and enqueues its log
+    line; a listener thread writes the rotating log file off the hot path.
+    """
+
+    def __init__(self, log_file):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)  # (metric, labels) -> total
+        self.histograms = {}  # (metric, labels) -> [bucket counts, sum, count]
+        self.logger = logging.getLogger("osce.llm_calls")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers.clear()
+        self.listener = None
+        if log_file:
+            Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+            file_handler = RotatingFileHandler(log_file, maxBytes=LLM_LOG_MAX_BYTES, backupCount=LLM_LOG_BACKUP_COUNT, encoding="utf-8")
+            log_queue = queue.SimpleQueue()
+            self.listener = QueueListener(log_queue, file_handler)
+            self.listener.start()
+            self.logger.addHandler(QueueHandler(log_queue))
+            # Writes out the queued lines when the process exits
+            atexit.register(self.close)
+
+    def record(self, call):
+        labels = (
+            ("purpose", call["purpose"]), ("backend", call["backend"] or ""),
+            ("model", call["model"] or ""), ("scenario", call["scenario_id"] or ""),
+        )
+        outcome = "error" if call["error"] else "ok"
+        with self.lock:
+            self.counters[("osce_llm_requests_total", labels + (("outcome", outcome),))] += 1
+            self.counters[("osce_llm_retries_total", labels)] += call["retries"]
+            self.counters[("osce_llm_fallbacks_total", labels)] += call["fallbacks"]
+            self.counters[("osce_llm_prompt_tokens_total", labels)] += call["prompt_tokens"] or 0
+            self.counters[("osce_llm_completion_tokens_total", labels)] += call["completion_tokens"] or 0
+            self.counters[("osce_llm_cost_usd_total", labels)] += call["cost_usd"] or 0
+            self._observe("osce_llm_latency_seconds", labels, call["wall_time"])
+            self._observe("osce_llm_queue_seconds", labels, call["queue_time"])
+            if call["time_to_first_token"] is not None:
+                self._observe("osce_llm_time_to_first_token_seconds", labels, call["time_to_first_token"])
+        if self.listener is not None:
+            self.logger.info(json.dumps(call))
+
+    def _observe(self, metric, labels, value):
+        histogram = self.histograms.setdefault((metric, labels), [[0] * len(LLM_LATENCY_BUCKETS), 0.0, 0])
+        for i, bound in enumerate(LLM_LATENCY_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+    def render_prometheus(self):
+        """Returns the aggregates in the Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(buckets), total, count)) for key, (buckets, total, count) in self.histograms.items())
+
+        def format_labels(labels):
+            return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+        lines = []
+        for (metric, labels), value in counters:
+            if f"# TYPE {metric} counter" not in lines:
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{format_labels(labels)} {value:g}")
+        for (metric, labels), (buckets, total, count) in histograms:
+            if f"# TYPE {metric} histogram" not in lines:
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(LLM_LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{metric}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{metric}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.logger.handlers.clear()
+
+@st.cache_resource(on_release=LLMTelemetry.close)
+def get_llm_telemetry():
+    """Creates the LLM call telemetry shared by every session in this process."""
+    return LLMTelemetry(LLM_LOG_FILE)
+
+@st.cache_resource
+def start_metrics_server(host, port):
+    """Serves the LLM call metrics in the Prometheus text format on /metrics."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0].rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = get_llm_telemetry().render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
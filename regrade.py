@@ -0,0 +1,237 @@
+"""Re-grades stored OSCE submissions against the current scenario rubrics.
+
+Reads submitted encounters from the encounter database (or a JSONL file of
+records), scores them and generates feedback with the same prompts as the
+app, and appends one JSON result per record to the output file. Re-running
+the same command resumes from the records already in the output, and grades
+again the records whose rubric or examiner prompts have changed since.
+
+    GROQ_API_KEY=gsk_... python regrade.py --output regrade.jsonl --scenario mr_smith_leg_ulcer
+
+Set GROQ_BASE_URL (or --base-url) to run against a local mock endpoint.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+import streamlit.logger
+
+# The app's caches warn about the missing Streamlit server for every function
+streamlit.logger.set_log_level("error")
+import streamlit_osce_app as app
+from encounter_store import ENCOUNTER_DB_FILE, EncounterStore
+from llm_client import api_key_digest, get_groq_backend, llm_complete, new_llm_call
+
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD date into a local Unix timestamp."""
+    return datetime.strptime(value, "%Y-%m-%d").timestamp()
+
+
+def load_database_records(db_file, student_id=None, scenario_id=None, since=None, until=None):
+    """Yields the submitted encounters in the encounter database as grading records."""
+    store = EncounterStore(db_file)
+    try:
+        for encounter in store.find_encounters(student_id, scenario_id, since, until):
+            events, submission = [], None
+            for kind, payload in store.load_events(encounter["encounter_id"]):
+                if kind in ("chat", "action"):
+                    events.append(app.EncounterEvent(kind, **payload))
+                elif kind == "submitted":
+                    submission = payload
+            if submission is None:
+                continue
+            yield {
+                "record_id": encounter["encounter_id"],
+                "student_id": encounter["student_id"],
+                "scenario_id": encounter["scenario_id"],
+                "events": events,
+                "ddx": submission["ddx"],
+                "plan": submission["plan"],
+            }
+    finally:
+        store.close()
+
+
+def load_jsonl_records(path):
+    """Yields grading records from a JSONL file.
+
+    Each line needs record_id, scenario_id, events (the encounter's chat and
+    action events, as stored in the encounter log plus their kind), ddx and
+    plan; student_id is optional.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            missing = [field for field in ("record_id", "scenario_id", "events", "ddx", "plan") if field not in record]
+            if missing:
+                raise ValueError(f"{path}:{line_number} is missing {', '.join(missing)}.")
+            record["events"] = [app.EncounterEvent(**event) for event in record["events"]]
+            yield record
+
+
+def rubric_version(scenario_id, scenario):
+    """Fingerprints a scenario's rubric and examiner prompts, so a change to either is graded afresh."""
+    prompts = app.get_scenario_prompts(scenario_id)
+    content = json.dumps([scenario["expert_assessment"], [prompts[title].fingerprint for title in app.FEEDBACK_SECTIONS]], sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def submission_key(record, version):
+    """Identifies a submission by its scenario, rubric, transcript, actions and answers."""
+    events = record["events"]
+    content = json.dumps([
+        record["scenario_id"], version, app.format_transcript(events), app.performed_actions(events),
+        record["ddx"].strip(), record["plan"].strip(),
+    ])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def read_checkpoint(output):
+    """Returns the graded results already in the output, by record ID and by submission key."""
+    by_record, by_key = {}, {}
+    if not output.exists():
+        return by_record, by_key
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by an interrupted run
+            if result.get("status") == "ok":
+                by_record[result["record_id"]] = result
+                by_key[result["submission_key"]] = result
+    return by_record, by_key
+
+
+def grade(backend, scenario, record):
+    """Scores one submission and generates its feedback sections."""
+    events = record["events"]
+    transcript = app.format_transcript(events)
+    actions = app.performed_actions(events)
+    score = app.score_submission(scenario, record["ddx"], record["plan"], transcript, actions)
+    prompts = app.build_feedback_section_prompts(record["scenario_id"], transcript, actions, record["ddx"], record["plan"], score)
+    feedback, errors = {}, {}
+    for title, prompt in prompts.items():
+        call = new_llm_call("regrade", scenario_id=record["scenario_id"])
+        try:
+            feedback[title] = llm_complete(backend, call, **app.feedback_section_request(*prompt))
+        except Exception as e:
+            errors[title] = f"{type(e).__name__}: {e}"
+    return score, feedback, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, required=True, help="JSONL file the results are appended to.")
+    parser.add_argument("--input", type=Path, help="Grade records from this JSONL file instead of the encounter database.")
+    parser.add_argument("--db", default=ENCOUNTER_DB_FILE, help="Encounter database to read submissions from.")
+    parser.add_argument("--student", help="Only grade this student's encounters.")
+    parser.add_argument("--scenario", help="Only grade encounters of this scenario.")
+    parser.add_argument("--since", type=parse_date, help="Only grade encounters started on or after this date (YYYY-MM-DD).")
+    parser.add_argument("--until", type=parse_date, help="Only grade encounters started before this date (YYYY-MM-DD).")
+    parser.add_argument("--workers", type=int, default=8, help="Submissions graded concurrently.")
+    parser.add_argument("--api-key", default=os.environ.get("GROQ_API_KEY"), help="Groq API key (default: $GROQ_API_KEY).")
+    parser.add_argument("--base-url", help="Send requests to this Groq-compatible server, e.g. a local mock.")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("an API key is needed, via --api-key or GROQ_API_KEY")
+    if args.base_url:
+        os.environ["GROQ_BASE_URL"] = args.base_url
+    backend = get_groq_backend(api_key_digest(args.api_key), args.api_key)
+
+    if args.input:
+        records = load_jsonl_records(args.input)
+    else:
+        records = load_database_records(args.db, args.student, args.scenario, args.since, args.until)
+
+    done_records, done_keys = read_checkpoint(args.output)
+    scenarios, versions = {}, {}
+    pending = {}  # submission key -> records sharing that submission
+    skipped = reused = 0
+    for record in records:
+        scenario_id = record["scenario_id"]
+        if scenario_id not in scenarios:
+            try:
+                scenarios[scenario_id] = app.load_scenario(scenario_id)
+            except (OSError, ValueError) as e:
+                print(f"Skipping record {record['record_id']}: {e}", file=sys.stderr)
+                continue
+            versions[scenario_id] = rubric_version(scenario_id, scenarios[scenario_id])
+        key = submission_key(record, versions[scenario_id])
+        # A record graded under another rubric or submission is graded again
+        previous = done_records.get(record["record_id"])
+        if previous is not None and previous["submission_key"] == key:
+            skipped += 1
+            continue
+        pending.setdefault(key, []).append(record)
+
+    print(f"{sum(len(group) for group in pending.values())} records to grade as {len(pending)} unique submissions "
+          f"({skipped} already graded).", file=sys.stderr, flush=True)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    graded = failed = 0
+    with open(args.output, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        def write_results(key, group, score, feedback, errors):
+            for record in group:
+                output.write(json.dumps({
+                    "record_id": record["record_id"],
+                    "student_id": record.get("student_id"),
+                    "scenario_id": record["scenario_id"],
+                    "rubric_version": versions[record["scenario_id"]],
+                    "submission_key": key,
+                    "status": "failed" if errors else "ok",
+                    "graded_at": time.time(),
+                    "score": score,
+                    "feedback": feedback,
+                    "errors": errors,
+                }) + "\n")
+            output.flush()
+
+        # Keeps at most two submissions per worker queued, however many there are
+        in_flight = {}
+        submissions = iter(pending.items())
+        while True:
+            for key, group in submissions:
+                if key in done_keys:
+                    # Graded before under another record ID
+                    previous = done_keys[key]
+                    write_results(key, group, previous["score"], previous["feedback"], {})
+                    reused += len(group)
+                    continue
+                future = executor.submit(grade, backend, scenarios[group[0]["scenario_id"]], group[0])
+                in_flight[future] = (key, group)
+                if len(in_flight) >= args.workers * 2:
+                    break
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, group = in_flight.pop(future)
+                try:
+                    score, feedback, errors = future.result()
+                except Exception as e:
+                    score, feedback, errors = None, {}, {"record": f"{type(e).__name__}: {e}"}
+                write_results(key, group, score, feedback, errors)
+                if errors:
+                    failed += len(group)
+                else:
+                    graded += len(group)
+            print(f"Graded {graded}, failed {failed}, reused {reused}", file=sys.stderr, flush=True)
+
+    print(f"Done: {graded} graded, {failed} failed, {reused} reused, {skipped} skipped. "
+          f"Results in {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,213 +1,875 @@
 import streamlit as st
+import hashlib
+import json
+import logging
+import math
+import queue
+import random
+import re
+import secrets
+import threading
 import time
-from groq import Groq
+import uuid
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from pathlib import Path
+from groq import AuthenticationError
+
+from encounter_store import ENCOUNTER_DB_FILE, EncounterStore
+from llm_client import (
+    LLM_MAX_RETRIES, api_key_digest, count_message_tokens, count_tokens, get_groq_backend,
+    llm_complete, llm_deadline, llm_stream, new_llm_call, validate_api_key,
+)
+from llm_telemetry import LLM_METRICS_HOST, LLM_METRICS_PORT, start_metrics_server
 
 # --- CONFIGURATION ---
 # (Same as original)
-ENCOUNTER_TIME = 600  # 10 minutes
+ENCOUNTER_TIME = 600  # 10 minutes, unless a scenario sets its own "encounter_time"
+TIMER_CHECK_SECONDS = 2  # How often the server checks whether the encounter time is up
+CONTEXT_TOKEN_BUDGET = 1500  # Max prompt tokens sent per patient turn
+RECENT_TURNS_KEPT = 6  # Latest chat messages always sent verbatim
+SUMMARY_WORDS_PER_TURN = 25  # Words kept per older turn in the running summary
+STORY_FACTS_TOP_K = 4  # Patient story facts retrieved for each question
+STORY_FACTS_FOLLOW_UP_K = 2  # Facts retrieved for the previous question, for follow-ups
+STORY_FACTS_MIN_SCORE = 1.0  # Best BM25 score below which the whole story is sent instead
+BM25_K1 = 1.5
+BM25_B = 0.75
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "at", "be", "been", "but", "by", "can", "did", "do", "does",
+    "for", "from", "had", "has", "have", "how", "i", "if", "in", "is", "it", "me", "my", "of",
+    "on", "or", "so", "that", "the", "there", "this", "to", "was", "were", "what", "when",
+    "where", "which", "who", "why", "with", "you", "your",
+}
+RESPONSE_CACHE_MAX_ENTRIES = 5000  # Patient replies kept across all sessions
+RESPONSE_CACHE_TTL = 6 * 60 * 60  # Seconds before a cached reply expires
+RESPONSE_CACHE_SIMILARITY = 0.9  # Min similarity for a near-duplicate question to share a reply
+FILLER_WORDS = {"please", "um", "uh", "ok", "okay", "so", "well", "and", "now"}
+ACTION_CATEGORIES = {  # Scenario sections holding action findings, with their result labels
+    "physical_exam": "Physical Exam",
+    "lab_results": "Lab/Imaging",
+    "referrals": "Referral",
+}
+FEEDBACK_SECTIONS = (
+    "Differential Diagnosis Evaluation",
+    "Management Plan Evaluation",
+    "History Taking & Physical Exam Performance",
+    "Overall Summary & Key Learning Points",
+)
+FEEDBACK_SECTION_MAX_TOKENS = 700  # Completion tokens per feedback section
+FEEDBACK_MAX_WORKERS = 32  # Concurrent feedback requests across all sessions
+GREETING_POOL_SIZE = 4  # Opening greetings kept ready per scenario
+GREETING_MAX_WORKERS = 4  # Concurrent greeting generations across all scenarios
+GREETING_TEMPERATURE = 1.0  # Above the patient turns' 0.7, so pooled greetings vary
+DIAGNOSIS_MATCH_THRESHOLD = 0.6  # Min share of a diagnosis name's terms a DDx item must contain
+FEATURE_MATCH_THRESHOLD = 0.6  # Min share of a rubric feature's terms that must be found
+PLAN_POINT_MATCH_THRESHOLD = 0.4  # Min share of a plan rubric point's key terms in the plan
+FUZZY_TERM_SIMILARITY = 0.85  # Min similarity for a misspelled term to still match
+# Marks a clause of a DDx or plan as negated, e.g. "not a venous ulcer" or "no compression"
+NEGATION_PATTERN = re.compile(r"\b(?:no|not|without|never|unlikely|excluded|ruled out|isn't|doesn't|don't)\b", re.IGNORECASE)
+TRAILING_NEGATIONS = {"unlikely", "excluded", "ruled out"}  # Cues that negate what comes before them, e.g. "DVT ruled out"
+# Clinical abbreviations and synonyms, expanded on both sides before rubric matching
+CLINICAL_SYNONYMS = {
+    "pad": "peripheral arterial disease",
+    "cvi": "chronic venous insufficiency",
+    "chf": "congestive heart failure",
+    "hf": "heart failure",
+    "cad": "coronary artery disease",
+    "dm": "diabetes",
+    "t2dm": "type 2 diabetes",
+    "a1c": "hba1c",
+    "abi": "ankle brachial index",
+    "dvt": "deep vein thrombosis",
+    "pt": "physical therapy",
+    "hha": "home health",
+    "pcp": "primary care",
+    "ischemic": "arterial",
+    "ischaemic": "arterial",
+    "artery": "arterial",
+    "vein": "venous",
+    "stasis": "venous",
+    "arteriovenous": "arterial venous",
+    "neuropathic": "diabetic",
+    "sore": "ulcer",
+    "wound": "ulcer",
+    "swelling": "edema",
+    "oedema": "edema",
+    "compression": "compressive",
+    "cardiology": "cardiologist",
+    "podiatry": "podiatrist",
+}
+# Qualifiers in rubric features that students rarely repeat (stemmed)
+SCORING_STOPWORDS = {"histor", "symptom", "sign", "finding", "featur", "significant", "typical", "typicall", "not"}
+CLINICAL_SYNONYM_PATTERNS = [
+    (re.compile(rf"\b{re.escape(term)}\b"), expansion) for term, expansion in CLINICAL_SYNONYMS.items()
+]
+# Lay terms students use, mapped to the wording of the patient stories
+QUERY_SYNONYMS = {
+    "smoke": ["pack", "cigarette", "tobacco"],
+    "cigarette": ["smoker", "pack"],
+    "alcohol": ["drink", "beer", "wine"],
+    "drink": ["beer", "alcohol", "wine"],
+    "medication": ["taking", "pill", "prescribed"],
+    "pill": ["medications", "taking"],
+    "family": ["mother", "father", "sibling"],
+    "work": ["retired", "job"],
+    "job": ["retired", "work"],
+    "live": ["home", "house"],
+    "breathing": ["short"],
+    "fever": ["chills", "warm"],
+    "pain": ["tender", "hurt"],
+    "hurt": ["pain", "tender"],
+    "surgery": ["cabg", "surgery"],
+    "operation": ["cabg", "surgery"],
+    "swelling": ["shoes", "tighter"],
+    "swollen": ["shoes", "tighter"],
+    "sugar": ["diabetes"],
+}
 
 # --- PATIENT SCENARIOS ---
-# (Same as original, truncated for brevity in this comment block but full in code)
-SCENARIOS = {
-    "Mr. Smith - Leg Ulcer": {
-        "name": "James Smith", "age": 72, "gender": "Male",
-        "vitals": "BP: 152/90, HR: 74, RR: 20, Temp: 37.2°C, SpO2: 95%, BMI: 29",
-        "chief_complaint": "A new blister on his left lower leg.",
-        "true_diagnosis": "Venous Stasis Ulcer with co-existing Peripheral Artery Disease (PAD), exacerbated by poorly controlled Diabetes and CHF.",
-        "patient_story": """
-        - You first noticed the ulcer ten days ago.
-        - It seemed to get larger, and 3 days ago started to release a thin bloody fluid.
-        - You've never had these kinds of blisters before, but your skin seems thin and gets damaged easily if you bump your leg.
-        - Your everyday shoes feel tighter than usual.
-        - You deny having fevers or chills, but the ulcer site feels warm and is tender to the touch.
-        - At first you did nothing, but once it started draining, you started cleaning it with soap and water and covering it with gauze.
-        - You've also noticed pain in your legs that is worse when you walk (claudication), especially up and down stairs, but it gets better when you rest.
-        - You deny any numbness or tingling in your feet.
-        - You've been feeling more short of breath lately with activity.
-        - Your medical history includes: Coronary Artery Disease (had a CABG surgery at age 67), Aortic Stenosis, and Congestive Heart Failure.
-        - You also have Type 2 Diabetes, diagnosed in your 50s.
-        - Your mother died of a stroke at 72 (she also had diabetes). Your father died of a heart attack at 70 (he had high cholesterol).
-        - You are a retired accountant and a current smoker with a 50-pack-year history. You drink 1-2 beers a week.
-        - You live in a two-story home with your wife, who had a stroke 2 years ago. Your bedroom is on the second floor.
-        - REGARDING YOUR MEDICATIONS:
-        - You recently stopped taking your Lisinopril because you noticed it gives you an annoying cough.
-        - You know Furosemide is a 'water pill' so you often skip it on days you plan to go out, so you don't have to be near a bathroom.
-        - You take your Atorvastatin, Aspirin, Metoprolol, and Dapagliflozin as prescribed.
-        """,
-        "physical_exam": {
-            "Check Vitals": "Temperature: 37.2°C, Blood Pressure: 152/90, HR: 74 bpm, RR: 20, SpO2: 95% on room air, BMI: 29.",
-            "Auscultate Heart": "Crescendo-decrescendo systolic murmur heard best at the upper right sternal border, radiating to the carotids. An S3 gallop is present. Rhythm is regular.",
-            "Auscultate Chest": "Bibasilar crackles are heard on auscultation. No wheezes.",
-            "Check JVP": "Jugular Venous Pressure (JVP) is elevated at 10 cm.",
-            "Inspect Extremities": "Upon removing socks/shoes: Bilateral 2+ pitting edema is present up to the mid-thigh. Scars from bilateral saphenous vein harvesting are visible. Toes are encrusted with severely dystrophic toenails.",
-            "Examine Lower Leg Ulcer": "A 5cm x 5.5cm ulcer is located on the anterior calf. The border is round and irregular. The base is red, moist, and granulating. There is a moderate amount of serosanguinous drainage. The periwound skin shows scaling and hemosiderin deposition. There is no crepitus, fluctuance, or malodor.",
-            "Check Peripheral Pulses": "Pedal pulses (dorsalis pedis, posterior tibialis) are non-palpable bilaterally. Doppler signals are monophasic.",
-            "Check Capillary Refill": "Capillary refill in the toes is delayed, >3 seconds.",
-            "Perform Monofilament Test": "Patient has loss of protective sensation in a stocking distribution on both feet when tested with a 10g monofilament.",
-            "Assess Gait": "Patient walks with slow, small steps. Gait is flat-footed with limited knee flexion and extension, likely due to significant edema and pain.",
-            "Palpate Abdomen": "Abdomen is soft, non-tender, non-distended. No hepatosplenomegaly.",
-            "Neurological Exam": "Cranial nerves II-XII are intact. Strength is 5/5 throughout. Sensation to light touch is decreased in lower extremities."
-        },
-        "lab_results": {
-            "Order ABI": "Ankle-Brachial Index (ABI) result is 0.6, consistent with moderate peripheral artery disease.",
-            "Order Arterial Duplex": "Ultrasound shows monophasic waveforms throughout the lower extremities, confirming significant PAD.",
-            "Order Venous Duplex": "Ultrasound shows no acute DVT. There is evidence of great saphenous and perforator vein reflux, consistent with chronic venous insufficiency.",
-            "Order Wound Culture Swab": "Culture results are pending. Gram stain shows mixed flora with both gram-positive cocci and gram-negative rods.",
-            "Order ESR/CRP": "ESR: 45 mm/hr (Elevated), CRP: 2.5 mg/dL (Elevated).",
-            "Order CBC": "WBC: 7.2 (Normal), Hgb: 11.6 (Mild Anemia), Hct: 35%, Platelets: 320,000.",
-            "Order BMP": "Na+: 135, K+: 4.0, Cl-:100, Bicarbonate: 24, BUN: 28 (Elevated), Cr: 1.4 (Elevated).",
-            "Order HbA1c": "HbA1c is 8.5% (Poorly controlled).",
-            "Order ECG": "Shows normal sinus rhythm with non-specific ST changes. No signs of acute ischemia. The tracing is stable compared to a previous ECG from 3 months ago.",
-            "Order Chest X-Ray": "CXR reveals mild cardiomegaly and bibasilar atelectasis/edema, consistent with a mild CHF exacerbation.",
-            "Order Troponin": "Troponin is <0.01 ng/mL (Negative)."
-        },
-        "referrals": {
-            "Refer to PCP": "Role: Manage the interdisciplinary team, monitor progress, order labs, coordinate care, manage smoking cessation, and evaluate nutrition.",
-            "Refer to Cardiologist": "Role: Manage the patient's Peripheral Artery Disease (PAD), claudication, and Congestive Heart Failure (CHF), including diuresis. Will assess for medical management vs. revascularization of lower extremities.",
-            "Refer to Podiatrist": "**Emergency Consult Recommended**\nRole: Management of complex toe/toenail pathology, provide education on daily foot checks, perform regular foot exams, and assess footwear/hygiene for risk reduction.",
-            "Refer to Wound Care": "Role: Provide expert wound management including debridement, moist wound care, and edema control (compression therapy). Will coordinate with vascular surgery if needed.",
-            "Refer to Social Work": "Role: Arrange home health care, assess for mobility barriers at home (e.g., stairs), and connect the patient/family to programs and insurance coverage resources.",
-            "Refer to Home Health": "Role: A Home Health Aide (HHA) can be arranged for regular dressing changes and medication compliance checks.",
-            "Refer to Physical Therapy": "Role: Address mobility issues resulting from claudication pain and severe edema. Can provide an exercise regimen and gait training."
-        },
-        "expert_assessment": {
-            "differential_diagnosis_rubric": [
-                {
-                    "diagnosis": "Mixed Arterial-Venous Leg Ulcer",
-                    "concordant_features": "Edema, Venous duplex reflux, Claudication symptoms (ABI=0.6), CHF, Monophasic doppler, Posterior calf location, Granulating base, Serosanguinous drainage, Dystrophic toenails (ischemia).",
-                    "discordant_features": "Non-classical location (not medial 'gaiter' region).",
-                    "absent_but_expected_features": "N/A"
-                },
-                {
-                    "diagnosis": "Arterial Insufficiency Ulcer",
-                    "concordant_features": "Monophasic Doppler, Nonpalpable pulses, Claudication symptoms, ABI=0.6, CAD history, Smoking history, Dystrophic toenails (ischemia), Delayed capillary refill.",
-                    "discordant_features": "Significant serosanguinous drainage and edema (more typical of venous), Not a 'punched out' appearance, Not dry, Location is posterior calf rather than toes/heel.",
-                    "absent_but_expected_features": "N/A"
-                },
-                {
-                    "diagnosis": "Venous Stasis Ulcer",
-                    "concordant_features": "Venous duplex reflux, Significant edema, Hemosiderin staining, CHF history, Red granulating base, Scaling periwound (stasis dermatitis), Bibasilar crackles.",
-                    "discordant_features": "ABI=0.6 (indicates significant arterial component), Dystrophic toenails (ischemia), Claudication symptoms.",
-                    "absent_but_expected_features": "No lipodermatosclerosis, Abnormal location (not medial calf)."
-                },
-                {
-                    "diagnosis": "Diabetic (Neuropathic) Ulcer",
-                    "concordant_features": "Poorly controlled diabetes (A1c 8.5%), Co-existing vascular disease, Dystrophic toenails.",
-                    "discordant_features": "Protective sensation was lost on monofilament test, but ulcers are typically painless. Location is not on a typical weight-bearing surface (like bottom of foot). Ulcer is not necrotic.",
-                    "absent_but_expected_features": "Typically found on weight-bearing surfaces."
-                }
-            ],
-            "management_plan_rubric": {
-                "key_treatment_principles": """
-- **Initial Management:** Recognition that the ulcer is too tender for immediate sharp debridement.
-- **First-Line Therapy:** Autolytic debridement (using moisture-retentive dressings) combined with **modified/reduced compression therapy**. Standard high compression is contraindicated due to the arterial disease (ABI=0.6).
-- **Pathophysiology:** Understanding the interplay of venous hypertension (causing edema and leakage) and arterial insufficiency (causing ischemia and poor healing).
-""",
-                "goals_of_care": """
-- Pain and odor control.
-- Rapid return to prior functional status.
-- **Preventing recurrence** through long-term management.
-""",
-                "plan_of_care_considerations": """
-- **Patient Capabilities:** Recognize the need for Home Health due to complex medical needs and potential difficulty with self-care.
-- **Adherence:** Acknowledge patient's prior non-adherence (Lisinopril, Furosemide) and incorporate medication counseling and simplification.
-- **Family/Social Support:** Involve family in care instructions and assess their ability to help with appointments and home care.
-- **Interdisciplinary Team:** The plan must involve referrals to specialists (Cardiology, Podiatry, Wound Care) and support services (Social Work, PT, Home Health).
-- **Cost:** Acknowledge the need to understand insurance coverage for referrals and supplies.
-"""
-            }
-        }
-    }
+# Each case lives in its own JSON file in SCENARIOS_DIR. The index lists the
+# metadata shown on the selection screen; full cases are loaded when selected.
+SCENARIOS_DIR = Path(__file__).parent / "scenarios"
+SCENARIO_INDEX_FILE = "index.json"
+REQUIRED_SCENARIO_FIELDS = {
+    "name": str, "age": int, "gender": str, "vitals": str, "chief_complaint": str,
+    "true_diagnosis": str, "patient_story": str, "physical_exam": dict,
+    "lab_results": dict, "referrals": dict, "expert_assessment": dict,
 }
+REQUIRED_DDX_FIELDS = ("diagnosis", "concordant_features", "discordant_features")
+REQUIRED_PLAN_FIELDS = ("key_treatment_principles", "goals_of_care", "plan_of_care_considerations")
 
 # --- HELPER FUNCTIONS ---
 
+def validate_scenario(scenario_id, scenario):
+    """Raises a ValueError if a scenario does not match the expected schema."""
+    for field, field_type in REQUIRED_SCENARIO_FIELDS.items():
+        if not isinstance(scenario.get(field), field_type):
+            raise ValueError(f"Scenario '{scenario_id}' is missing '{field}' or it is not a {field_type.__name__}.")
+
+    encounter_time = scenario.get("encounter_time", ENCOUNTER_TIME)
+    if not isinstance(encounter_time, int) or encounter_time <= 0:
+        raise ValueError(f"Scenario '{scenario_id}' has an invalid 'encounter_time'; it must be a positive number of seconds.")
+
+    for field in ("physical_exam", "lab_results", "referrals"):
+        for action, result in scenario[field].items():
+            if not isinstance(result, str):
+                raise ValueError(f"Scenario '{scenario_id}' has a non-text result for '{action}' in '{field}'.")
+
+    rubric = scenario["expert_assessment"]
+    ddx_rubric = rubric.get("differential_diagnosis_rubric")
+    if not isinstance(ddx_rubric, list) or not ddx_rubric:
+        raise ValueError(f"Scenario '{scenario_id}' needs a non-empty 'differential_diagnosis_rubric'.")
+    for item in ddx_rubric:
+        missing = [field for field in REQUIRED_DDX_FIELDS if not isinstance(item.get(field), str)]
+        if missing:
+            raise ValueError(f"Scenario '{scenario_id}' has a DDx rubric entry missing {', '.join(missing)}.")
+
+    for item in ddx_rubric:
+        if not all(isinstance(name, str) for name in item.get("synonyms", [])):
+            raise ValueError(f"Scenario '{scenario_id}' has non-text synonyms for '{item['diagnosis']}'.")
+    known_actions = {**scenario["physical_exam"], **scenario["lab_results"], **scenario["referrals"]}
+    unknown = [action for action in rubric.get("key_actions", []) if action not in known_actions]
+    if unknown:
+        raise ValueError(f"Scenario '{scenario_id}' lists unknown key actions: {', '.join(unknown)}.")
+
+    plan_rubric = rubric.get("management_plan_rubric")
+    if not isinstance(plan_rubric, dict):
+        raise ValueError(f"Scenario '{scenario_id}' needs a 'management_plan_rubric'.")
+    missing = [field for field in REQUIRED_PLAN_FIELDS if not isinstance(plan_rubric.get(field), str)]
+    if missing:
+        raise ValueError(f"Scenario '{scenario_id}' has a management plan rubric missing {', '.join(missing)}.")
+
+    plan_key_terms = rubric.get("plan_key_terms", {})
+    if not isinstance(plan_key_terms, dict):
+        raise ValueError(f"Scenario '{scenario_id}' has a 'plan_key_terms' that is not a mapping.")
+    labels = {rubric_point_label(point) for field in REQUIRED_PLAN_FIELDS for point in split_rubric_points(plan_rubric[field])}
+    unknown = [label for label in plan_key_terms if label not in labels]
+    if unknown:
+        raise ValueError(f"Scenario '{scenario_id}' has key terms for unknown plan points: {', '.join(unknown)}.")
+    for label, terms in plan_key_terms.items():
+        if not isinstance(terms, list) or not terms or not all(isinstance(term, str) and term.strip() for term in terms):
+            raise ValueError(f"Scenario '{scenario_id}' needs a non-empty list of key terms for plan point '{label}'.")
+
+@st.cache_data
+def load_scenario_index():
+    """Reads the scenario metadata shown on the selection screen."""
+    with open(SCENARIOS_DIR / SCENARIO_INDEX_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+@st.cache_resource
+def load_scenario(scenario_id):
+    """Loads and validates a full scenario once and shares it across sessions.
+
+    The returned dict is shared, so callers must treat it as read-only.
+    """
+    entry = next((item for item in load_scenario_index() if item["id"] == scenario_id), None)
+    if entry is None:
+        raise ValueError(f"Scenario '{scenario_id}' is not in the scenario index.")
+    with open(SCENARIOS_DIR / entry["file"], encoding="utf-8") as f:
+        scenario = json.load(f)
+    validate_scenario(scenario_id, scenario)
+    return scenario
+
+# One entry in an encounter's event stream. A chat turn has the speaker's role
+# as key and the text as content. An action has the action name as key and the
+# scenario section holding its finding as category (None if the scenario has
+# no such action); the finding itself is looked up in the scenario when shown.
+EncounterEvent = namedtuple("EncounterEvent", ["kind", "key", "timestamp", "category", "content"], defaults=(None, None, None))
+
+# The static prefix of a prompt, rendered once per scenario, with a short
+# fingerprint to check that requests share it and its approximate token count
+PromptTemplate = namedtuple("PromptTemplate", ["prefix", "fingerprint", "prefix_tokens"])
+
+def chat_event(role, content):
+    """Creates the event for a chat message from the student or the patient."""
+    return EncounterEvent("chat", role, time.time(), content=content)
+
+def event_payload(event):
+    """Returns the compact form of an event stored in the encounter log."""
+    return {field: value for field, value in event._asdict().items() if field != "kind" and value is not None}
+
+@st.cache_resource
+def get_action_index(scenario_id):
+    """Maps each action in a scenario to the section holding its finding, once per scenario."""
+    scenario = load_scenario(scenario_id)
+    index = {}
+    for category in ACTION_CATEGORIES:
+        for action in scenario.get(category, {}):
+            index.setdefault(action, category)
+    return index
+
+def action_finding(scenario, event):
+    """Returns the scenario's finding for an action event, or None if there is none.
+
+    An action logged before the scenario was edited may no longer have one.
+    """
+    if event.category is None:
+        return None
+    return scenario.get(event.category, {}).get(event.key)
+
 def initialize_state():
     """Initializes the session state variables."""
     if "page" not in st.session_state:
         st.session_state.page = "api_key_entry"
-    if "groq_client" not in st.session_state:
-        st.session_state.groq_client = None
+    if "groq_backend" not in st.session_state:
+        st.session_state.groq_backend = None
+    if "scenario_key" not in st.session_state:
+        st.session_state.scenario_key = None
     if "current_scenario" not in st.session_state:
         st.session_state.current_scenario = None
-    if "conversation_history" not in st.session_state:
-        st.session_state.conversation_history = []
-    if "results" not in st.session_state:
-        st.session_state.results = []
+    if "events" not in st.session_state:
+        st.session_state.events = []
     if "encounter_active" not in st.session_state:
         st.session_state.encounter_active = False
     if "start_time" not in st.session_state:
         st.session_state.start_time = 0
+    if "time_up" not in st.session_state:
+        st.session_state.time_up = False
+    if "submission" not in st.session_state:
+        st.session_state.submission = {}
+    if "rubric_score" not in st.session_state:
+        st.session_state.rubric_score = None
     if "feedback" not in st.session_state:
-        st.session_state.feedback = ""
+        st.session_state.feedback = {}
+    if "turn_metrics" not in st.session_state:
+        st.session_state.turn_metrics = []
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if "student_id" not in st.session_state:
+        st.session_state.student_id = ""
+    if "cohort" not in st.session_state:
+        st.session_state.cohort = ""
+    if "encounter_id" not in st.session_state:
+        st.session_state.encounter_id = None
+    if "saved_events" not in st.session_state:
+        st.session_state.saved_events = 0
+
+@st.cache_resource(on_release=EncounterStore.close)
+def get_encounter_store():
+    """Opens the encounter store shared by every session in this process."""
+    return EncounterStore(ENCOUNTER_DB_FILE)
+
+def save_encounter_progress():
+    """Appends the chat turns and actions added since the last save to the encounter log."""
+    encounter_id = st.session_state.encounter_id
+    if encounter_id is None:
+        return
+    store = get_encounter_store()
+    events = st.session_state.events
+    for event in events[st.session_state.saved_events:]:
+        store.append_event(encounter_id, event.kind, event_payload(event))
+    st.session_state.saved_events = len(events)
+
+def save_encounter_event(kind, payload, status):
+    """Logs a change of encounter stage and updates the encounter's status."""
+    encounter_id = st.session_state.encounter_id
+    if encounter_id is None:
+        return
+    store = get_encounter_store()
+    store.append_event(encounter_id, kind, payload)
+    store.set_status(encounter_id, status)
+
+def save_encounter_stats(score):
+    """Adds the encounter being completed to the cohort analytics counters."""
+    encounter_id = st.session_state.encounter_id
+    if encounter_id is None:
+        return
+    action_times = {}
+    for event in st.session_state.events:
+        if event.kind == "action" and event.key not in action_times:
+            action_times[event.key] = event.timestamp - st.session_state.start_time
+    named = [d["diagnosis"] for d in score["diagnoses"] if d["named"]]
+    get_encounter_store().record_completion(encounter_id, action_times, named)
+
+def reset_encounter_state():
+    """Clears the encounter data from the session, keeping the client and student."""
+    st.session_state.scenario_key = None
+    st.session_state.current_scenario = None
+    st.session_state.encounter_id = None
+    st.session_state.events = []
+    st.session_state.saved_events = 0
+    st.session_state.turn_metrics = []
+    st.session_state.encounter_active = False
+    st.session_state.start_time = 0
+    st.session_state.time_up = False
+    st.session_state.submission = {}
+    st.session_state.rubric_score = None
+    st.session_state.feedback = {}
+
+def resume_encounter(encounter):
+    """Rebuilds a saved encounter in the session by replaying its event log.
+
+    The timer keeps running from the saved start time, so time spent
+    disconnected still counts against the encounter. Actions are looked up in
+    the scenario as it is now, which may have been edited since they were logged.
+    """
+    scenario = load_scenario(encounter["scenario_id"])
+    prepare_scenario(encounter["scenario_id"])
+    reset_encounter_state()
+    st.session_state.scenario_key = encounter["scenario_id"]
+    st.session_state.current_scenario = scenario
+    st.session_state.encounter_id = encounter["encounter_id"]
+    st.session_state.page = "main_encounter"
+    for kind, payload in get_encounter_store().load_events(encounter["encounter_id"]):
+        if kind == "started":
+            st.session_state.start_time = payload["start_time"]
+            st.session_state.encounter_active = True
+        elif kind == "chat":
+            st.session_state.events.append(EncounterEvent(kind, **payload))
+        elif kind == "action":
+            category = get_action_index(encounter["scenario_id"]).get(payload["key"])
+            st.session_state.events.append(EncounterEvent(kind, **{**payload, "category": category}))
+        elif kind == "ended":
+            st.session_state.encounter_active = False
+            st.session_state.time_up = payload["time_up"]
+            st.session_state.page = "assessment"
+        elif kind == "submitted":
+            st.session_state.submission = payload
+            st.session_state.page = "feedback"
+        elif kind == "feedback":
+            st.session_state.feedback = payload["sections"]
+            st.session_state.rubric_score = payload["rubric_score"]
+    st.session_state.saved_events = len(st.session_state.events)
+
+def summarize_turns(turns):
+    """Condenses older conversation turns into a short running summary."""
+    lines = []
+    for msg in turns:
+        words = msg["content"].split()
+        text = " ".join(words[:SUMMARY_WORDS_PER_TURN])
+        if len(words) > SUMMARY_WORDS_PER_TURN:
+            text += "..."
+        speaker = "The doctor asked" if msg["role"] == "user" else "You answered"
+        lines.append(f"- {speaker}: {text}")
+    return "Summary of the earlier conversation (stay consistent with it):\n" + "\n".join(lines)
+
+def chat_messages(events):
+    """Returns the chat turns of an event stream as chat completion messages."""
+    return [{"role": event.key, "content": event.content} for event in events if event.kind == "chat"]
+
+def student_questions(events):
+    """Returns the questions the student has asked, in order."""
+    return [event.content for event in events if event.kind == "chat" and event.key == "user"]
+
+def build_context_messages(persona, events, facts=()):
+    """Builds the token-budgeted list of messages sent for a patient turn.
+
+    The persona prompt is always kept verbatim, followed by the story facts
+    retrieved for this question. Actions are collapsed into a single line,
+    and once the budget is exceeded the oldest turns are folded into a
+    summary while the most recent ones are kept as they were.
+    """
+    turns = chat_messages(events)
+    # An action ordered again adds nothing the patient needs to know
+    actions = list(dict.fromkeys(performed_actions(events)))
+
+    messages = [{"role": "system", "content": persona}]
+    if facts:
+        facts_text = "\n".join(f"- {fact}" for fact in facts)
+        messages.append({"role": "system", "content": f"Facts from your Patient Story relevant to this question:\n{facts_text}"})
+    if actions:
+        messages.append({"role": "system", "content": f"Actions performed by the doctor so far (do not comment on them): {', '.join(actions)}"})
+
+    if count_message_tokens(messages + turns) <= CONTEXT_TOKEN_BUDGET:
+        return messages + turns
+
+    # Keep as many recent turns verbatim as the budget allows
+    keep = min(len(turns), RECENT_TURNS_KEPT)
+    while keep < len(turns):
+        candidate = turns[-(keep + 1):]
+        summary = {"role": "system", "content": summarize_turns(turns[:-(keep + 1)])}
+        if count_message_tokens(messages + [summary] + candidate) > CONTEXT_TOKEN_BUDGET:
+            break
+        keep += 1
+    recent = turns[-keep:] if keep else []
+    older = turns[:len(turns) - keep]
+
+    # Drop the oldest summarized turns if even the summary does not fit
+    while older:
+        summary = {"role": "system", "content": summarize_turns(older)}
+        if count_message_tokens(messages + [summary] + recent) <= CONTEXT_TOKEN_BUDGET:
+            return messages + [summary] + recent
+        older = older[1:]
+    return messages + recent
+
+def stem(word):
+    """Reduces a word to a crude stem so that 'smoker' and 'smoking', or 'diabetic' and 'diabetes', match."""
+    for suffix in ("ings", "ing", "ers", "er", "ies", "ed", "es", "ic", "ly", "s", "e", "y"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def tokenize_for_search(text):
+    """Splits text into lowercase, stemmed search terms without stopwords."""
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+def split_story_facts(patient_story):
+    """Splits a patient story into its individual bullet points.
+
+    A bullet ending in a colon is a heading and is prefixed to the bullets below it.
+    """
+    facts = []
+    heading = ""
+    for line in patient_story.splitlines():
+        line = line.strip().lstrip("-").strip()
+        if not line:
+            continue
+        if line.endswith(":"):
+            heading = line
+            continue
+        facts.append(f"{heading} {line}" if heading else line)
+    return facts
+
+class StoryIndex:
+    """A small BM25 index over the facts of one patient story."""
+
+    def __init__(self, facts):
+        self.facts = facts
+        self.synonyms = {
+            stem(word): {stem(synonym) for synonym in synonyms}
+            for word, synonyms in QUERY_SYNONYMS.items()
+        }
+        self.fact_terms = [tokenize_for_search(fact) for fact in facts]
+        self.avg_length = sum(len(terms) for terms in self.fact_terms) / max(len(facts), 1)
+        document_frequency = {}
+        for terms in self.fact_terms:
+            for term in set(terms):
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        self.idf = {
+            term: math.log(1 + (len(facts) - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_frequency.items()
+        }
+
+    def search(self, query, k, min_score=0.0):
+        """Returns the indices of the k facts that best match the query.
+
+        Returns nothing if even the best match scores below min_score.
+        """
+        query_terms = set()
+        for term in tokenize_for_search(query):
+            query_terms.add(term)
+            query_terms.update(self.synonyms.get(term, ()))
+        query_terms &= self.idf.keys()
+        if not query_terms:
+            return []
+
+        scores = []
+        for i, terms in enumerate(self.fact_terms):
+            score = 0.0
+            for term in query_terms:
+                freq = terms.count(term)
+                if freq:
+                    norm = 1 - BM25_B + BM25_B * len(terms) / self.avg_length
+                    score += self.idf[term] * freq * (BM25_K1 + 1) / (freq + BM25_K1 * norm)
+            if score > 0:
+                scores.append((score, i))
+        scores.sort(reverse=True)
+        if not scores or scores[0][0] < min_score:
+            return []
+        return [i for _, i in scores[:k]]
+
+@st.cache_resource
+def get_story_index(scenario_key):
+    """Builds the story index for a scenario once and shares it across sessions."""
+    return StoryIndex(split_story_facts(load_scenario(scenario_key)["patient_story"]))
+
+def retrieve_story_facts(scenario_key, events):
+    """Finds the patient story facts relevant to the latest question.
+
+    The previous question is searched as well so that follow-ups like
+    'how long has that been going on?' keep their context. If nothing in the
+    story matches the latest question well, the whole story is returned, so
+    the patient never denies a fact only because it was not retrieved.
+    """
+    questions = student_questions(events)
+    if not questions:
+        return []
+
+    index = get_story_index(scenario_key)
+    hits = index.search(questions[-1], STORY_FACTS_TOP_K, STORY_FACTS_MIN_SCORE)
+    if not hits:
+        return list(index.facts)
+    if len(questions) > 1:
+        for i in index.search(questions[-2], STORY_FACTS_FOLLOW_UP_K):
+            if i not in hits:
+                hits.append(i)
+    # Keep the facts in story order so they read naturally
+    return [index.facts[i] for i in sorted(hits)]
+
+def normalize_question(text):
+    """Normalizes a student question for cache lookups."""
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+class ResponseCache:
+    """A thread-safe LRU cache of patient replies shared by all sessions.
+
+    Replies are keyed on the scenario, a digest of the relevant prior context and
+    the normalized question. A question in the same scenario and context that is
+    a near-duplicate of a cached one, with the same search terms, is served the
+    same reply.
+    """
+
+    def __init__(self, max_entries, ttl, similarity):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries = OrderedDict()  # (scenario, digest, question) -> (reply, expires_at)
+        self.buckets = {}  # (scenario, digest) -> questions cached in that context
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scenario_key, digest, question):
+        """Returns the cached reply for a question, or None on a miss."""
+        with self.lock:
+            reply = self._lookup((scenario_key, digest, question))
+            if reply is None:
+                # Only stopwords and word endings may differ, so "mother" never matches "father"
+                terms = set(tokenize_for_search(question))
+                for other in list(self.buckets.get((scenario_key, digest), ())):
+                    if not terms or set(tokenize_for_search(other)) != terms:
+                        continue
+                    if SequenceMatcher(None, question, other).ratio() >= self.similarity:
+                        reply = self._lookup((scenario_key, digest, other))
+                        if reply is not None:
+                            break
+            if reply is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return reply
+
+    def put(self, scenario_key, digest, question, reply, expires=True):
+        """Caches a reply, evicting the least recently used entries if full."""
+        key = (scenario_key, digest, question)
+        expires_at = time.time() + self.ttl if expires else None
+        with self.lock:
+            self.entries[key] = (reply, expires_at)
+            self.entries.move_to_end(key)
+            self.buckets.setdefault(key[:2], set()).add(question)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        reply, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return reply
+
+    def _remove(self, key):
+        del self.entries[key]
+        bucket = self.buckets.get(key[:2])
+        if bucket is not None:
+            bucket.discard(key[2])
+            if not bucket:
+                del self.buckets[key[:2]]
+
+@st.cache_resource
+def get_response_cache():
+    """Creates the response cache shared by every session in this process."""
+    return ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIMILARITY)
+
+def response_cache_key(events, facts):
+    """Builds the (context digest, normalized question) cache key for a patient turn.
 
-def call_groq_api():
-    """Calls the Groq API and updates the conversation history."""
+    The digest covers the previous question and the story facts sent with this
+    one, which is the prior context a patient reply actually depends on.
+    """
+    questions = [normalize_question(question) for question in student_questions(events)]
+    question = questions[-1] if questions else ""
+    previous_question = questions[-2] if len(questions) > 1 else ""
+    context = "\n".join([previous_question, *facts])
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()[:16], question
+
+def session_llm_call(purpose):
+    """Starts the telemetry record of an LLM call made for the current session."""
+    return new_llm_call(purpose, st.session_state.session_id, st.session_state.scenario_key)
+
+def call_groq_api(chat_container=None):
+    """Calls the Groq API and adds the patient's reply to the event stream.
+
+    If a chat container is given, the reply is streamed into it token-by-token.
+    Replies are served from the shared response cache when possible.
+    """
+    events = st.session_state.events
+    scenario_key = st.session_state.scenario_key
+    scenario = st.session_state.current_scenario
+    persona = get_scenario_prompts(scenario_key)["patient"].prefix
+    facts = retrieve_story_facts(scenario_key, events)
+    messages = build_context_messages(persona, events, facts)
+    prompt_tokens = count_message_tokens(messages)
+    # What the turn would cost with the whole story and history resent
+    full_history = [{"role": "system", "content": persona}] + chat_messages(events)
+    full_prompt_tokens = count_message_tokens(full_history) + count_tokens(scenario["patient_story"])
+
+    # The opening greeting is identical per scenario, so it is always cached. A
+    # question that normalizes to nothing, like "Okay.", is never cached, as it
+    # would share the greeting's key.
+    digest, question = response_cache_key(events, facts)
+    is_greeting = not student_questions(events)
+    use_cache = is_greeting or (bool(question) and scenario.get("cache_responses", True))
+    cache = get_response_cache()
+
+    start = time.perf_counter()
+    cached_reply = cache.get(scenario_key, digest, question) if use_cache else None
+    if cached_reply is not None:
+        events.append(chat_event("assistant", cached_reply))
+        if chat_container is not None:
+            with chat_container.chat_message("assistant"):
+                st.markdown(cached_reply)
+        elapsed = time.perf_counter() - start
+        record_turn_metrics(elapsed, elapsed, 0, full_prompt_tokens, cached=True)
+        return
+
+    if chat_container is not None:
+        first_token_time, total_time, completed = stream_groq_api(messages, chat_container)
+    else:
+        first_token_time, total_time, completed = complete_groq_api(messages)
+    record_turn_metrics(first_token_time, total_time, prompt_tokens, full_prompt_tokens)
+
+    if completed and use_cache:
+        cache.put(scenario_key, digest, question, events[-1].content, expires=not is_greeting)
+
+def complete_groq_api(messages):
+    """Requests the patient's whole reply in one blocking call.
+
+    Returns the time to first token, the total time and whether the reply completed.
+    """
+    call = session_llm_call("patient")
     try:
-        chat_completion = st.session_state.groq_client.chat.completions.create(
-            messages=st.session_state.conversation_history,
-            model="llama3-8b-8192",
+        response = llm_complete(
+            st.session_state.groq_backend,
+            call,
+            messages=messages,
             temperature=0.7,
             max_tokens=200,
         )
-        response = chat_completion.choices[0].message.content
-        st.session_state.conversation_history.append({"role": "assistant", "content": response})
     except Exception as e:
-        st.error(f"Error communicating with Groq API: {e}")
-        # Add an error message to history to unblock user
-        st.session_state.conversation_history.append({"role": "assistant", "content": f"Sorry, a system error occurred: {e}"})
+        report_unanswered_turn(e)
+        return None, call["wall_time"], False
+    st.session_state.events.append(chat_event("assistant", response))
+    return call["wall_time"], call["wall_time"], True
 
-def build_initial_prompt():
-    """Creates the initial system prompt for the Groq AI."""
-    scenario = st.session_state.current_scenario
-    prompt = f"""
+def stream_groq_api(messages, chat_container):
+    """Streams the patient's reply into the chat container as tokens arrive.
+
+    A reply cut off mid-stream is discarded and requested again, within the
+    time budget of a single patient call.
+    Returns the time to first token, the total time and whether the reply completed.
+    """
+    start = time.perf_counter()
+    deadline = llm_deadline("patient")
+    error = None
+
+    with chat_container.chat_message("assistant"):
+        placeholder = st.empty()
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            placeholder.markdown("_Patient is thinking..._")
+            first_token_time = None
+            chunks = []
+            try:
+                stream = llm_stream(
+                    st.session_state.groq_backend,
+                    session_llm_call("patient"),
+                    deadline,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=200,
+                )
+                for token in stream:
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter() - start
+                    chunks.append(token)
+                    placeholder.markdown("".join(chunks) + "▌")
+                error = None
+                break
+            except ConnectionError as e:
+                error = e
+                if time.monotonic() >= deadline:
+                    break
+            except Exception as e:
+                # Failures before the stream started were already retried by the scheduler
+                error = e
+                break
+
+        if error is None:
+            placeholder.markdown("".join(chunks))
+        else:
+            placeholder.empty()
+
+    if error is not None:
+        report_unanswered_turn(error)
+        return None, time.perf_counter() - start, False
+    st.session_state.events.append(chat_event("assistant", "".join(chunks)))
+    return first_token_time, time.perf_counter() - start, True
+
+def report_unanswered_turn(error):
+    """Shows why the patient did not reply and takes back the unanswered question.
+
+    Nothing is saved as the patient's reply, so the transcript that is graded
+    later only holds real exchanges.
+    """
+    events = st.session_state.events
+    if events and events[-1].kind == "chat" and events[-1].key == "user":
+        events.pop()
+        st.error(f"The patient couldn't answer just now ({error}). Please ask your question again.")
+    else:
+        st.error(f"The patient couldn't respond just now ({error}).")
+
+def record_turn_metrics(time_to_first_token, total_time, prompt_tokens, full_prompt_tokens, cached=False):
+    """Records the latency and prompt size of a patient reply in the session state."""
+    st.session_state.turn_metrics.append({
+        "time_to_first_token": time_to_first_token,
+        "total_time": total_time,
+        "prompt_tokens": prompt_tokens,
+        "full_prompt_tokens": full_prompt_tokens,
+        "cached": cached,
+    })
+
+class GreetingPool:
+    """Opening greetings per scenario, generated in the background ahead of use.
+
+    Taking a greeting never waits on the LLM. Each greeting taken is replaced
+    by a newly generated one; while the pool is being refilled, a greeting
+    that was already served is reused.
+    """
+
+    def __init__(self, size, executor):
+        self.size = size
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.ready = defaultdict(list)
+        self.served = defaultdict(list)
+        self.pending = defaultdict(int)
+
+    def warm(self, scenario_id, groq_backend):
+        """Starts generating greetings until the scenario's pool is full."""
+        with self.lock:
+            missing = self.size - len(self.ready[scenario_id]) - self.pending[scenario_id]
+            self.pending[scenario_id] += max(missing, 0)
+        for _ in range(missing):
+            self.executor.submit(self._generate, scenario_id, groq_backend)
+
+    def take(self, scenario_id, groq_backend):
+        """Returns a greeting for the scenario, or None if none has been generated yet."""
+        with self.lock:
+            if self.ready[scenario_id]:
+                greeting = self.ready[scenario_id].pop(0)
+                others = [served for served in self.served[scenario_id] if served != greeting]
+                self.served[scenario_id] = [greeting, *others][:self.size]
+            elif self.served[scenario_id]:
+                greeting = random.choice(self.served[scenario_id])
+            else:
+                greeting = None
+        self.warm(scenario_id, groq_backend)
+        return greeting
+
+    def _generate(self, scenario_id, groq_backend):
+        greeting = None
+        try:
+            persona = get_scenario_prompts(scenario_id)["patient"].prefix
+            greeting = llm_complete(
+                groq_backend,
+                new_llm_call("greeting", scenario_id=scenario_id),
+                messages=[{"role": "system", "content": persona}],
+                temperature=GREETING_TEMPERATURE,
+                max_tokens=200,
+            ).strip()
+        except Exception:
+            logging.getLogger(__name__).exception("Could not generate a greeting for %s", scenario_id)
+        finally:
+            with self.lock:
+                self.pending[scenario_id] -= 1
+                if greeting and greeting not in self.ready[scenario_id]:
+                    self.ready[scenario_id].append(greeting)
+
+@st.cache_resource
+def get_greeting_pool():
+    """Creates the greeting pool shared by every session in this process."""
+    executor = ThreadPoolExecutor(max_workers=GREETING_MAX_WORKERS, thread_name_prefix="greeting")
+    return GreetingPool(GREETING_POOL_SIZE, executor)
+
+def prepare_scenario(scenario_id):
+    """Builds what an encounter of the scenario needs before Start Encounter is clicked."""
+    get_scenario_prompts(scenario_id)
+    get_story_index(scenario_id)
+    get_action_index(scenario_id)
+    get_greeting_pool().warm(scenario_id, st.session_state.groq_backend)
+
+def patient_persona_prompt(scenario):
+    """Creates the system prompt that casts the model as the scenario's patient."""
+    return f"""
     You are an AI patient simulator for a medical OSCE.
     Your name is {scenario['name']}, you are a {scenario['age']}-year-old {scenario['gender']}.
     Your chief complaint is: "{scenario['chief_complaint']}".
 
     You MUST follow these rules:
-    1.  Act exactly like the patient based on the history provided below. Respond naturally, in the first person. Do not act like an AI.
+    1.  Act exactly like the patient based on the facts from your Patient Story provided with each question. Respond naturally, in the first person. Do not act like an AI.
     2.  Do NOT reveal any information from your 'Patient Story' unless the user asks a specific and relevant question.
     3.  Keep your answers concise and patient-like. Express emotion like pain or anxiety where appropriate.
     4.  If you don't have information about a specific question, say something like 'I don't know' or 'I'm not sure, doctor.'
     5.  Do NOT respond to or acknowledge physical exam or lab orders. The system handles those separately. Only answer conversational questions.
+    6.  Only the parts of your Patient Story relevant to the current question are given to you. Never contradict what you have already said.
 
-    Your Patient Story (Base all your answers on this):
-    ---
-    {scenario['patient_story']}
-    ---
     The user is a physician-in-training. The encounter now begins. Your first response should be a simple greeting.
     """
-    st.session_state.conversation_history = [{"role": "system", "content": prompt}]
-    # Get the initial greeting from the patient
-    call_groq_api()
 
 def perform_action(action_key):
-    """Handles a physical exam, lab order, or referral."""
-    scenario = st.session_state.current_scenario
-    result_type = "Action"
-    result = None
-
-    if action_key in scenario.get('physical_exam', {}):
-        result = scenario['physical_exam'][action_key]
-        result_type = "Physical Exam"
-    elif action_key in scenario.get('lab_results', {}):
-        result = scenario['lab_results'][action_key]
-        result_type = "Lab/Imaging"
-    elif action_key in scenario.get('referrals', {}):
-        result = scenario['referrals'][action_key]
-        result_type = "Referral"
-
-    if result:
-        result_text = f"**{result_type} Result for '{action_key}':**\n\n{result}"
-        st.session_state.results.append(result_text)
-        st.session_state.conversation_history.append(
-            {"role": "system", "content": f"'{action_key}' was performed. See the 'Results' tab for findings."}
-        )
-    else:
-        st.session_state.conversation_history.append(
-            {"role": "system", "content": f"The action '{action_key}' is not relevant or available for this patient scenario."}
-        )
+    """Handles a physical exam, lab order, or referral.
+
+    Only the action and the scenario section holding its finding are recorded;
+    the finding is looked up in the scenario whenever it is shown.
+    """
+    category = get_action_index(st.session_state.scenario_key).get(action_key)
+    st.session_state.events.append(EncounterEvent("action", action_key, time.time(), category))
+    save_encounter_progress()
 
 # --- PAGE RENDERING FUNCTIONS ---
 
@@ -219,44 +881,166 @@ def render_api_key_entry():
     st.markdown("Please enter your Groq API key to begin the simulation. Your key is not stored or shared.")
     
     api_key = st.text_input("Groq API Key", type="password", placeholder="gsk_...")
+    student_id = st.text_input("Student ID", value=st.query_params.get("student", ""), help="Saved with your encounters. Reopen the encounter's link to resume it.")
+    cohort = st.text_input("Cohort (optional)", value=st.query_params.get("cohort", ""), help="Groups your results with your class in the cohort analytics.")
 
     if st.button("Validate and Continue"):
         if not api_key:
             st.error("API Key cannot be empty.")
             return
+        if not student_id.strip():
+            st.error("Student ID cannot be empty.")
+            return
 
         with st.spinner("Validating API key..."):
             try:
-                test_client = Groq(api_key=api_key)
-                test_client.chat.completions.create(messages=[{"role": "user", "content": "test"}], model="llama3-8b-8192")
-                st.session_state.groq_client = test_client
+                key_digest = api_key_digest(api_key)
+                backend = get_groq_backend(key_digest, api_key)
+                validate_api_key(key_digest, backend)
+                st.session_state.groq_backend = backend
+                st.session_state.student_id = student_id.strip()
+                st.session_state.cohort = cohort.strip()
+                # Keeps the student ID in the URL, so a reload does not have to ask for it again
+                st.query_params["student"] = st.session_state.student_id
+                if st.session_state.cohort:
+                    st.query_params["cohort"] = st.session_state.cohort
                 st.session_state.page = "scenario_selection"
                 st.rerun()
             except Exception as e:
+                if isinstance(e, AuthenticationError):
+                    # Don't keep a connection pool open for a rejected key
+                    get_groq_backend.clear(key_digest, api_key)
                 st.error(f"Invalid API Key. Please try again. Error: {e}")
 
+    if st.button("View Cohort Analytics"):
+        st.session_state.page = "analytics"
+        st.rerun()
+
 # CORRECTED VERSION
 
 def render_scenario_selection():
     """Displays the screen to select a patient scenario."""
     st.header("Select a Patient Scenario")
-    
-    for scenario_name in SCENARIOS.keys():
-        # The 'height=50' parameter has been removed from this line
-        if st.button(scenario_name, use_container_width=True):
+
+    # Only the link of the encounter, with its resume token, can resume it
+    unfinished = get_encounter_store().find_open_encounter(st.session_state.student_id, st.query_params.get("resume"))
+    if unfinished is not None:
+        titles = {entry["id"]: entry["title"] for entry in load_scenario_index()}
+        started = time.strftime("%d %b %H:%M", time.localtime(unfinished["started_at"]))
+        st.info(f"You have an unfinished encounter: {titles.get(unfinished['scenario_id'], unfinished['scenario_id'])}, started {started}.")
+        if st.button("Resume Encounter", type="primary", use_container_width=True):
+            try:
+                resume_encounter(unfinished)
+            except (OSError, ValueError) as e:
+                st.error(f"Could not resume this encounter: {e}")
+                return
+            st.rerun()
+
+    for entry in load_scenario_index():
+        if st.button(entry["title"], key=f"scenario_{entry['id']}", use_container_width=True):
+            try:
+                scenario = load_scenario(entry["id"])
+                prepare_scenario(entry["id"])
+            except (OSError, ValueError) as e:
+                st.error(f"Could not load this scenario: {e}")
+                return
             # Reset state for a new encounter
-            st.session_state.current_scenario = SCENARIOS[scenario_name]
-            st.session_state.conversation_history = []
-            st.session_state.results = []
-            st.session_state.encounter_active = False
-            st.session_state.start_time = 0
-            st.session_state.feedback = ""
+            reset_encounter_state()
+            st.session_state.scenario_key = entry["id"]
+            st.session_state.current_scenario = scenario
             st.session_state.page = "main_encounter"
             st.rerun()
 
+    st.divider()
+    if st.button("View Cohort Analytics"):
+        st.session_state.page = "analytics"
+        st.rerun()
+
+def format_duration(seconds):
+    """Formats a number of seconds as minutes and seconds, e.g. 2:05."""
+    minutes, seconds = divmod(round(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+def render_analytics():
+    """Displays which actions and diagnoses students chose, by scenario and cohort.
+
+    Everything shown is summed from the daily counters kept as encounters are
+    completed, so the page stays fast however many encounters are stored.
+    """
+    st.header("Cohort Analytics")
+    store = get_encounter_store()
+    titles = {entry["id"]: entry["title"] for entry in load_scenario_index()}
+
+    scenario_col, cohort_col, dates_col = st.columns(3)
+    scenario_id = scenario_col.selectbox(
+        "Scenario", [None, *titles], format_func=lambda value: "All scenarios" if value is None else titles[value],
+    )
+    cohort = cohort_col.selectbox(
+        "Cohort", [None, *store.list_cohorts()], format_func=lambda value: "All cohorts" if value is None else (value or "No cohort"),
+    )
+    dates = dates_col.date_input("Started between", value=())
+    since = dates[0].isoformat() if len(dates) > 0 else None
+    until = dates[1].isoformat() if len(dates) > 1 else since
+
+    encounters, counters = {}, {}
+    for row in store.cohort_stats(scenario_id, cohort, since, until):
+        if row["metric"] == "encounters":
+            encounters[row["scenario_id"]] = row["count"]
+        else:
+            counters[row["scenario_id"], row["metric"], row["item"]] = row
+
+    st.metric("Completed encounters", sum(encounters.values()))
+    if not encounters:
+        st.info("No completed encounters match these filters yet.")
+    else:
+        # Every action and rubric diagnosis is listed, including those nobody chose
+        action_rows, diagnosis_rows = [], []
+        for scenario_key, total in encounters.items():
+            try:
+                scenario = load_scenario(scenario_key)
+            except (OSError, ValueError):
+                continue
+            title = titles.get(scenario_key, scenario_key)
+            key_actions = scenario["expert_assessment"].get("key_actions") or derive_key_actions(scenario)
+            for action, category in get_action_index(scenario_key).items():
+                row = counters.get((scenario_key, "action", action))
+                action_rows.append({
+                    "Scenario": title,
+                    "Action": action,
+                    "Type": ACTION_CATEGORIES[category],
+                    "Key action": action in key_actions,
+                    "Ordered in": (row["count"] if row else 0) / total,
+                    "Avg. time to first order": format_duration(row["total_seconds"] / row["count"]) if row else "",
+                })
+            for diagnosis in scenario["expert_assessment"]["differential_diagnosis_rubric"]:
+                row = counters.get((scenario_key, "diagnosis", diagnosis["diagnosis"]))
+                diagnosis_rows.append({
+                    "Scenario": title,
+                    "Diagnosis": diagnosis["diagnosis"],
+                    "Named in": (row["count"] if row else 0) / total,
+                })
+
+        percent = st.column_config.NumberColumn(format="percent")
+        st.subheader("Exams, Investigations & Referrals")
+        action_rows.sort(key=lambda row: (row["Scenario"], -row["Ordered in"]))
+        st.dataframe(action_rows, hide_index=True, use_container_width=True, column_config={"Ordered in": percent})
+        st.subheader("Differential Diagnoses Named")
+        st.dataframe(diagnosis_rows, hide_index=True, use_container_width=True, column_config={"Named in": percent})
+
+    if st.button("Back"):
+        st.session_state.page = "scenario_selection" if st.session_state.groq_backend else "api_key_entry"
+        st.rerun()
+
 def render_main_encounter():
-    """Renders the main UI for the OSCE simulation."""
+    """Renders the main UI for the OSCE simulation.
+
+    The chat, the actions and results, and the timer are fragments, so each one
+    reruns on its own instead of re-executing the whole page.
+    """
     scenario = st.session_state.current_scenario
+    if st.session_state.encounter_active and encounter_time_remaining() <= 0:
+        end_encounter(time_up=True)
+        st.rerun()
     st.title(f"OSCE Encounter: {scenario['name']}")
 
     # --- Layout ---
@@ -265,9 +1049,14 @@ def render_main_encounter():
     # --- Left Panel (Patient Info & Controls) ---
     with left_col:
         st.header("Patient Chart")
-        
+
         # Timer
-        timer_placeholder = st.empty()
+        if st.session_state.encounter_active:
+            render_countdown(encounter_time_remaining())
+            check_encounter_expiry()
+        else:
+            mins, secs = divmod(scenario.get("encounter_time", ENCOUNTER_TIME), 60)
+            st.metric("Timer", f"{mins:02d}:{secs:02d}")
 
         info_text = f"""
         - **Name:** {scenario['name']}
@@ -284,96 +1073,191 @@ def render_main_encounter():
 
         if not st.session_state.encounter_active:
             if st.button("Start Encounter", type="primary", use_container_width=True):
-                st.session_state.encounter_active = True
-                st.session_state.start_time = time.time()
-                build_initial_prompt()
-                st.rerun()
+                # On failure, stay on this run so the error stays on screen
+                if start_encounter():
+                    st.rerun()
         
         if st.session_state.encounter_active:
             if st.button("End Encounter & Assess", type="secondary", use_container_width=True):
-                st.session_state.encounter_active = False
-                st.session_state.page = "assessment"
+                end_encounter()
                 st.rerun()
 
     # --- Center Panel (Conversation) ---
     with center_col:
-        st.header("Conversation")
-        chat_container = st.container(height=600, border=True)
-
-        for message in st.session_state.conversation_history:
-            if message["role"] == "system":
-                # Don't show the initial system prompt, but show system messages
-                if not message["content"].strip().startswith("You are an AI patient simulator"):
-                    chat_container.info(message["content"])
-            else:
-                with chat_container.chat_message(message["role"]):
-                    st.markdown(message["content"])
-        
-        # Handle chat input
-        if prompt := st.chat_input("Type your question to the patient...", disabled=not st.session_state.encounter_active):
-            st.session_state.conversation_history.append({"role": "user", "content": prompt})
-            with chat_container.chat_message("user"):
-                st.markdown(prompt)
-            
-            with st.spinner("Patient is thinking..."):
-                call_groq_api()
-            st.rerun()
+        render_chat_panel()
 
     # --- Right Panel (Actions & Results) ---
     with right_col:
-        st.header("Actions & Results")
-        
-        exam_tab, labs_tab, referrals_tab, results_tab = st.tabs(["Physical Exam", "Order Labs/Imaging", "Referrals", "Results"])
+        render_actions_panel()
 
-        with exam_tab:
-            exam_actions = list(scenario.get('physical_exam', {}).keys())
-            for action in exam_actions:
-                if st.button(action, key=f"exam_{action}", use_container_width=True, disabled=not st.session_state.encounter_active):
-                    perform_action(action)
-                    st.rerun()
+    # Everything above, the greeting included, has been sent to the browser by now
+    if st.session_state.encounter_active and not st.session_state.start_time:
+        start_encounter_clock()
 
-        with labs_tab:
-            lab_actions = list(scenario.get('lab_results', {}).keys())
-            for action in lab_actions:
-                if st.button(action, key=f"lab_{action}", use_container_width=True, disabled=not st.session_state.encounter_active):
-                    perform_action(action)
-                    st.rerun()
-        
-        with referrals_tab:
-            referral_actions = list(scenario.get('referrals', {}).keys())
-            for action in referral_actions:
-                if st.button(action, key=f"ref_{action}", use_container_width=True, disabled=not st.session_state.encounter_active):
-                    perform_action(action)
-                    st.rerun()
+@st.fragment
+def render_chat_panel():
+    """Renders the conversation; a new chat turn only reruns this panel."""
+    st.header("Conversation")
+    chat_container = st.container(height=600, border=True)
 
-        with results_tab:
-            if not st.session_state.results:
-                st.info("Results from exams, labs, and referrals will appear here.")
-            else:
-                for res in reversed(st.session_state.results):
-                    st.markdown("---")
-                    st.markdown(res)
-    
-    # --- Timer Logic ---
-    if st.session_state.encounter_active:
-        elapsed_time = time.time() - st.session_state.start_time
-        remaining_time = ENCOUNTER_TIME - elapsed_time
-        
-        if remaining_time > 0:
-            mins, secs = divmod(int(remaining_time), 60)
-            timer_placeholder.metric("Timer", f"{mins:02d}:{secs:02d}")
+    # Actions are reported by the actions panel, which is the one they rerun
+    for event in st.session_state.events:
+        if event.kind == "chat":
+            with chat_container.chat_message(event.key):
+                st.markdown(event.content)
+
+    # Handle chat input; the reply is streamed straight into the open container
+    if prompt := st.chat_input("Type your question to the patient...", disabled=not st.session_state.encounter_active):
+        st.session_state.events.append(chat_event("user", prompt))
+        with chat_container.chat_message("user"):
+            st.markdown(prompt)
+
+        call_groq_api(chat_container)
+        save_encounter_progress()
+
+    if st.session_state.turn_metrics:
+        with st.expander("Session Metrics"):
+            last_turn = st.session_state.turn_metrics[-1]
+            sent = sum(m["prompt_tokens"] for m in st.session_state.turn_metrics)
+            full = sum(m["full_prompt_tokens"] for m in st.session_state.turn_metrics)
+            if last_turn["time_to_first_token"] is not None:
+                st.markdown(f"- **First token:** {last_turn['time_to_first_token']:.2f}s")
+            st.markdown(f"- **Reply time:** {last_turn['total_time']:.2f}s")
+            st.markdown(f"- **Prompt tokens (last turn):** {last_turn['prompt_tokens']} of {last_turn['full_prompt_tokens']}")
+            st.markdown(f"- **Prompt tokens saved (encounter):** {full - sent}")
+            cache = get_response_cache()
+            st.markdown(f"- **Response cache (all sessions):** {cache.hits} hits, {cache.misses} misses")
+
+@st.fragment
+def render_actions_panel():
+    """Renders the action tabs and results; an action only reruns this panel.
+
+    The buttons record actions through callbacks, which run before the panel
+    reruns, so the results tab is already up to date without a full rerun.
+    """
+    scenario = st.session_state.current_scenario
+    st.header("Actions & Results")
+
+    exam_tab, labs_tab, referrals_tab, results_tab = st.tabs(["Physical Exam", "Order Labs/Imaging", "Referrals", "Results"])
+    disabled = not st.session_state.encounter_active
+
+    # Confirm the action just taken; the notice goes away with the next one or the next question
+    last_event = st.session_state.events[-1] if st.session_state.events else None
+    if last_event is not None and last_event.kind == "action":
+        if last_event.category is not None:
+            st.info(f"'{last_event.key}' was performed. See the 'Results' tab for findings.")
         else:
-            timer_placeholder.metric("Timer", "Time's Up!", delta="-10:00", delta_color="inverse")
-            st.session_state.encounter_active = False
-            # Automatically move to assessment when time is up
-            st.toast("Time's up! Please complete your assessment.")
-            time.sleep(2) # Give user a moment to see the message
-            st.session_state.page = "assessment"
-            st.rerun()
+            st.info(f"The action '{last_event.key}' is not relevant or available for this patient scenario.")
+
+    with exam_tab:
+        for action in scenario.get('physical_exam', {}):
+            st.button(action, key=f"exam_{action}", use_container_width=True, disabled=disabled, on_click=perform_action, args=(action,))
+
+    with labs_tab:
+        for action in scenario.get('lab_results', {}):
+            st.button(action, key=f"lab_{action}", use_container_width=True, disabled=disabled, on_click=perform_action, args=(action,))
+
+    with referrals_tab:
+        for action in scenario.get('referrals', {}):
+            st.button(action, key=f"ref_{action}", use_container_width=True, disabled=disabled, on_click=perform_action, args=(action,))
+
+    with results_tab:
+        performed = [event for event in st.session_state.events if event.kind == "action"]
+        if not performed:
+            st.info("Results from exams, labs, and referrals will appear here.")
+        else:
+            for event in reversed(performed):
+                finding = action_finding(scenario, event)
+                st.markdown("---")
+                if finding is None:
+                    st.markdown(f"**Result for '{event.key}':**\n\nThis finding is no longer available in the scenario.")
+                else:
+                    st.markdown(f"**{ACTION_CATEGORIES[event.category]} Result for '{event.key}':**\n\n{finding}")
+
+def encounter_time_remaining():
+    """Returns the seconds left in the encounter, using the scenario's time limit."""
+    time_limit = st.session_state.current_scenario.get("encounter_time", ENCOUNTER_TIME)
+    if not st.session_state.start_time:
+        # The clock has not started yet
+        return time_limit
+    return time_limit - (time.time() - st.session_state.start_time)
+
+def start_encounter():
+    """Starts the encounter with the patient's greeting; the clock starts once it is shown.
+
+    The greeting comes from the scenario's pre-generated pool, so this does not
+    wait on the LLM unless the pool has not been filled yet. Returns False, with
+    the encounter left unstarted, if the patient could not greet the student.
+    """
+    st.session_state.start_time = 0
+    st.session_state.encounter_id = uuid.uuid4().hex
+    st.session_state.events = []
+    greeting = get_greeting_pool().take(st.session_state.scenario_key, st.session_state.groq_backend)
+    if greeting is not None:
+        st.session_state.events.append(chat_event("assistant", greeting))
+    else:
+        call_groq_api()
+    # Without a greeting the LLM call failed and has already shown why
+    st.session_state.encounter_active = bool(st.session_state.events)
+    return st.session_state.encounter_active
+
+def start_encounter_clock():
+    """Starts the timer and opens the encounter's event log.
+
+    The encounter's resume token is put in the URL, so a reload of this page
+    can pick the encounter back up but the student ID alone cannot.
+    """
+    st.session_state.start_time = time.time()
+    resume_token = secrets.token_urlsafe(16)
+    get_encounter_store().open_encounter(
+        st.session_state.encounter_id, st.session_state.student_id, st.session_state.cohort,
+        st.session_state.scenario_key, st.session_state.start_time, resume_token,
+    )
+    st.query_params["resume"] = resume_token
+    save_encounter_progress()
+
+def end_encounter(time_up=False):
+    """Ends the encounter and moves the session to the assessment page."""
+    st.session_state.encounter_active = False
+    st.session_state.time_up = time_up
+    st.session_state.page = "assessment"
+    save_encounter_event("ended", {"time_up": time_up}, "ended")
+
+def render_countdown(remaining_time):
+    """Renders a countdown that ticks in the browser, with no server reruns."""
+    st.iframe(f"""
+        <div style="font-family: 'Source Sans Pro', sans-serif; color: rgb(49, 51, 63);">
+            <div style="font-size: 14px;">Timer</div>
+            <div id="clock" style="font-size: 2.25rem; line-height: 1.4;"></div>
+        </div>
+        <script>
+            // Count down from the browser's own clock so server and client clocks never need to agree
+            const end = Date.now() + {max(remaining_time, 0) * 1000:.0f};
+            const clock = document.getElementById("clock");
+            function tick() {{
+                const remaining = Math.max(0, Math.ceil((end - Date.now()) / 1000));
+                const mins = String(Math.floor(remaining / 60)).padStart(2, "0");
+                const secs = String(remaining % 60).padStart(2, "0");
+                clock.textContent = remaining > 0 ? `${{mins}}:${{secs}}` : "Time's Up!";
+                clock.style.color = remaining > 0 ? "" : "rgb(255, 43, 43)";
+            }}
+            tick();
+            setInterval(tick, 250);
+        </script>
+        """, height=90)
+
+@st.fragment(run_every=TIMER_CHECK_SECONDS)
+def check_encounter_expiry():
+    """Periodically checks on the server whether the encounter time is up."""
+    if st.session_state.encounter_active and encounter_time_remaining() <= 0:
+        end_encounter(time_up=True)
+        st.rerun(scope="app")
 
 def render_assessment():
     """Renders the final assessment form."""
     st.title("Final Assessment")
+    if st.session_state.time_up:
+        st.warning("Time's up! Please complete your assessment.")
     st.markdown("The encounter has ended. Please provide your differential diagnosis and proposed management plan.")
 
     with st.form("assessment_form"):
@@ -394,122 +1278,535 @@ def render_assessment():
             if not ddx or not plan:
                 st.error("Please fill out both fields before submitting.")
             else:
-                with st.spinner("Generating expert feedback on your performance... This may take a moment."):
-                    generate_feedback(ddx, plan)
+                st.session_state.submission = {"ddx": ddx, "plan": plan}
                 st.session_state.page = "feedback"
+                save_encounter_event("submitted", st.session_state.submission, "submitted")
                 st.rerun()
 
-def generate_feedback(ddx, plan):
-    """Asks the AI to generate feedback on the user's performance."""
-    scenario = st.session_state.current_scenario
-    transcript = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.conversation_history if msg['role'] != 'system'])
-    
-    feedback_prompt = ""
-
-    # Use the detailed rubric-based prompt if available
-    if 'expert_assessment' in scenario:
-        rubric = scenario['expert_assessment']
-        ddx_rubric_str = "\n\n".join([
-            f"Diagnosis: {item['diagnosis']}\n- Concordant: {item['concordant_features']}\n- Discordant: {item['discordant_features']}"
-            for item in rubric['differential_diagnosis_rubric']
-        ])
-        plan_rubric_str = (
-            f"Key Treatment Principles:\n{rubric['management_plan_rubric']['key_treatment_principles']}\n\n"
-            f"Goals of Care:\n{rubric['management_plan_rubric']['goals_of_care']}\n\n"
-            f"Plan of Care Considerations:\n{rubric['management_plan_rubric']['plan_of_care_considerations']}"
-        )
-        feedback_prompt = f"""
-        You are an expert OSCE examiner providing objective, standardized feedback based on a provided rubric.
-        A medical student has completed an encounter.
-        - **Patient's True Diagnosis:** {scenario['true_diagnosis']}
-        - **Full Encounter Transcript:** \n{transcript}
-        --- STUDENT'S SUBMISSION ---
-        **Student's Differential Diagnosis:**
-        {ddx}
-        **Student's Management Plan:**
-        {plan}
+def expand_clinical_terms(text):
+    """Lowercases text and appends the expansion of known abbreviations and synonyms."""
+    text = text.lower()
+    for pattern, expansion in CLINICAL_SYNONYM_PATTERNS:
+        text = pattern.sub(lambda match: f"{match.group(0)} {expansion}", text)
+    return text
+
+def scoring_terms(text):
+    """Returns the set of stemmed search terms in text after synonym expansion."""
+    return set(tokenize_for_search(expand_clinical_terms(text))) - SCORING_STOPWORDS
+
+def term_present(term, terms):
+    """Checks whether a term, a prefix variant of it or a close misspelling is in terms."""
+    if term in terms:
+        return True
+    for other in terms:
+        if other[:1] != term[:1]:
+            continue
+        if min(len(term), len(other)) >= 4 and (term.startswith(other) or other.startswith(term)):
+            return True
+        if SequenceMatcher(None, term, other).ratio() >= FUZZY_TERM_SIMILARITY:
+            return True
+    return False
+
+def term_recall(needed, available):
+    """Returns the fraction of the needed terms found among the available terms."""
+    if not needed:
+        return 0.0
+    return sum(term_present(term, available) for term in needed) / len(needed)
+
+def split_list_items(text):
+    """Splits free text such as a DDx list into its individual items."""
+    items = re.split(r"\n|;|(?:^|\s)\d+[.)]\s", text)
+    return [item.strip(" -*\t,.") for item in items if item.strip(" -*\t,.")]
+
+def split_features(features):
+    """Splits a comma-separated rubric feature list, ignoring 'N/A'."""
+    parts = re.split(r",(?![^(]*\))", features)
+    return [part.strip(" .") for part in parts if part.strip(" .") and part.strip(" .").upper() != "N/A"]
+
+def split_rubric_points(text):
+    """Splits a markdown rubric block into its bullet points."""
+    return [line.strip().lstrip("-").strip() for line in text.splitlines() if line.strip().lstrip("-").strip()]
+
+def split_clauses(text):
+    """Splits free text into clauses, so that a negation only covers its own clause."""
+    return [clause.strip() for clause in re.split(r"[,;\n]|\.(?!\d)|\bbut\b", text) if clause.strip()]
+
+def is_negated(text):
+    return NEGATION_PATTERN.search(text) is not None
+
+def affirmed_part(clause):
+    """Returns the part of a clause that its negation cue, if any, does not cover.
+
+    Most cues negate what follows them ('without infection'); trailing cues
+    negate what comes before them ('venous ulcer unlikely').
+    """
+    match = NEGATION_PATTERN.search(clause)
+    if match is None:
+        return clause
+    before, after = clause[:match.start()], clause[match.end():]
+    if match.group(0).lower() in TRAILING_NEGATIONS and before.strip():
+        return after
+    return before
+
+def affirmed_text(text):
+    """Drops the negated parts of DDx text, e.g. 'not a venous ulcer'.
+
+    A diagnosis is split from the findings given for it ('Arterial ulcer - no
+    palpable pulses', 'Venous ulcer (no DVT)') first, so that a negated finding
+    does not take the diagnosis with it.
+    """
+    clauses = split_clauses(re.sub(r"\s[-–]\s|[:()]", ";", text))
+    return " ".join(affirmed_part(clause) for clause in clauses)
+
+def rubric_point_label(point):
+    """Names a plan rubric point: its bolded label, or else its text without markdown."""
+    label = re.match(r"\*\*(.+?):\*\*", point)
+    if label:
+        return label.group(1).strip()
+    return point.replace("**", "").strip(" .")
+
+def plan_point_covered(point, key_terms, plan_clauses):
+    """Checks whether a plan covers a rubric point.
+
+    plan_clauses holds (clause, terms, affirmed terms) for each clause. With
+    key terms, the point is covered when one clause contains every term of one
+    key term outside the reach of a negation (so 'no compression' does not
+    count as 'modified compression'); a negated key term such as 'no sharp
+    debridement' must be matched by a negated clause. Points without key terms
+    fall back to matching the terms of the point itself.
+    """
+    if key_terms:
+        for key_term in key_terms:
+            needed = scoring_terms(key_term)
+            for clause, clause_terms, affirmed_terms in plan_clauses:
+                if is_negated(key_term):
+                    matched = is_negated(clause) and term_recall(needed, clause_terms) == 1.0
+                else:
+                    matched = term_recall(needed, affirmed_terms) == 1.0
+                if matched:
+                    return True
+        return False
+    affirmed_terms = set().union(*(terms for clause, clause_terms, terms in plan_clauses))
+    return term_recall(rubric_point_terms(point), affirmed_terms) >= PLAN_POINT_MATCH_THRESHOLD
+
+def rubric_point_terms(point):
+    """Returns the terms a plan must mention to cover a rubric bullet point.
+
+    Bolded phrases are the key terms of a point; a bolded label ending in a colon
+    is ignored. Points without bolded phrases are matched on their whole text.
+    """
+    bold = re.findall(r"\*\*(.+?)\*\*", point)
+    key_phrases = [phrase for phrase in bold if not phrase.rstrip().endswith(":")]
+    if key_phrases:
+        return scoring_terms(" ".join(key_phrases))
+    for label in bold:
+        point = point.replace(f"**{label}**", "")
+    return scoring_terms(point)
+
+def diagnosis_match(item_terms, diagnosis):
+    """Scores how well a student's DDx item names a rubric diagnosis.
+
+    Returns the number of name terms matched by the best-fitting name or synonym,
+    or 0 if no name is matched closely enough. Counting matched terms lets
+    'mixed arterial venous ulcer' prefer the mixed diagnosis over 'arterial ulcer'.
+    """
+    best = 0
+    for name in [diagnosis["diagnosis"], *diagnosis.get("synonyms", [])]:
+        name_terms = scoring_terms(name)
+        matched = sum(term_present(term, item_terms) for term in name_terms)
+        if name_terms and matched / len(name_terms) >= DIAGNOSIS_MATCH_THRESHOLD:
+            best = max(best, matched)
+    return best
+
+def derive_key_actions(scenario):
+    """Finds the exams and labs whose findings back a concordant rubric feature."""
+    feature_terms = [
+        scoring_terms(feature)
+        for item in scenario["expert_assessment"]["differential_diagnosis_rubric"]
+        for feature in split_features(item["concordant_features"])
+    ]
+    key_actions = []
+    for category in ("physical_exam", "lab_results"):
+        for action, result in scenario[category].items():
+            result_terms = scoring_terms(f"{action} {result}")
+            if any(terms and term_recall(terms, result_terms) >= FEATURE_MATCH_THRESHOLD for terms in feature_terms):
+                key_actions.append(action)
+    return key_actions
+
+def score_submission(scenario, ddx, plan, transcript, actions):
+    """Scores a submission against the scenario's expert rubric without any LLM call.
+
+    Matches the student's DDx against the rubric diagnoses and their synonyms,
+    checks which concordant features were cited in the DDx and elicited during
+    the encounter, which management plan points the plan covers, and which key
+    exams, labs and referrals were performed. What a negation covers, such as
+    'not a venous ulcer' or the 'no DVT' in 'venous ulcer (no DVT)', does not
+    count.
+    """
+    rubric = scenario["expert_assessment"]
+    performed = set(actions)
+    findings = " ".join(
+        scenario[category][action]
+        for action in performed
+        for category in ("physical_exam", "lab_results", "referrals")
+        if action in scenario[category]
+    )
+    ddx_terms = scoring_terms(affirmed_text(ddx))
+    encounter_terms = scoring_terms(f"{transcript} {findings}")
+
+    # Each DDx item counts towards the rubric diagnosis it matches best
+    ddx_items = [scoring_terms(affirmed_text(item)) for item in split_list_items(ddx)]
+    named_rank = {}
+    for rank, item_terms in enumerate(ddx_items, start=1):
+        scores = [diagnosis_match(item_terms, diagnosis) for diagnosis in rubric["differential_diagnosis_rubric"]]
+        best = max(range(len(scores)), key=scores.__getitem__, default=None)
+        if best is not None and scores[best]:
+            named_rank.setdefault(best, rank)
+
+    diagnoses = []
+    for i, diagnosis in enumerate(rubric["differential_diagnosis_rubric"]):
+        features = split_features(diagnosis["concordant_features"])
+        diagnoses.append({
+            "diagnosis": diagnosis["diagnosis"],
+            "named": i in named_rank,
+            "student_rank": named_rank.get(i),
+            "features_cited": [f for f in features if term_recall(scoring_terms(f), ddx_terms) >= FEATURE_MATCH_THRESHOLD],
+            "features_elicited": [f for f in features if term_recall(scoring_terms(f), encounter_terms) >= FEATURE_MATCH_THRESHOLD],
+            "features": features,
+        })
+
+    plan_clauses = [(clause, scoring_terms(clause), scoring_terms(affirmed_part(clause))) for clause in split_clauses(plan)]
+    plan_key_terms = rubric.get("plan_key_terms", {})
+    plan_points = []
+    for section in REQUIRED_PLAN_FIELDS:
+        for point in split_rubric_points(rubric["management_plan_rubric"][section]):
+            plan_points.append({
+                "section": section,
+                "point": point,
+                "covered": plan_point_covered(point, plan_key_terms.get(rubric_point_label(point)), plan_clauses),
+            })
+
+    key_actions = rubric.get("key_actions") or derive_key_actions(scenario)
+    action_categories = {
+        category: [action for action in scenario[category] if action in performed]
+        for category in ("physical_exam", "lab_results", "referrals")
+    }
+
+    named = sum(d["named"] for d in diagnoses)
+    covered = sum(p["covered"] for p in plan_points)
+    key_performed = [action for action in key_actions if action in performed]
+    section_scores = {
+        "differential_diagnosis": named / len(diagnoses),
+        "management_plan": covered / len(plan_points) if plan_points else 0.0,
+        "key_actions": len(key_performed) / len(key_actions) if key_actions else 0.0,
+    }
+    return {
+        "diagnoses": diagnoses,
+        "plan_points": plan_points,
+        "actions_performed": action_categories,
+        "key_actions_performed": key_performed,
+        "key_actions_missed": [action for action in key_actions if action not in performed],
+        "section_scores": section_scores,
+        "overall": sum(section_scores.values()) / len(section_scores),
+    }
+
+def format_ddx_score(score):
+    """Formats the DDx part of a rubric score as compact text for the examiner."""
+    lines = []
+    for d in score["diagnoses"]:
+        if d["named"]:
+            cited = ", ".join(d["features_cited"]) or "none"
+            missed = ", ".join(f for f in d["features"] if f not in d["features_cited"]) or "none"
+            lines.append(f"- NAMED (student rank {d['student_rank']}): {d['diagnosis']}. Features cited: {cited}. Features not cited: {missed}.")
+        else:
+            lines.append(f"- MISSED: {d['diagnosis']}. Supporting features: {', '.join(d['features'])}.")
+    return "\n".join(lines)
+
+def format_plan_score(score):
+    """Formats the management plan part of a rubric score as compact text for the examiner."""
+    return "\n".join(
+        f"- {'COVERED' if p['covered'] else 'NOT COVERED'}: {p['point']}"
+        for p in score["plan_points"]
+    )
+
+def format_actions_score(score):
+    """Formats the exam and investigation part of a rubric score as compact text for the examiner."""
+    return (
+        f"- Key actions performed: {', '.join(score['key_actions_performed']) or 'none'}\n"
+        f"- Key actions missed: {', '.join(score['key_actions_missed']) or 'none'}"
+    )
+
+def examiner_prompt_prefixes(scenario):
+    """Builds the static part of each examiner prompt, which depends only on the scenario.
+
+    Every prefix starts with the same examiner instructions and true diagnosis,
+    so the sections also share that part of the provider's prefix cache.
+    """
+    rubric = scenario['expert_assessment']
+    discordant_str = "\n".join(
+        f"- {item['diagnosis']}: {item['discordant_features']}"
+        for item in rubric['differential_diagnosis_rubric']
+    )
+    examiner = "You are an expert OSCE examiner providing objective, standardized feedback based on a provided rubric. A medical student has completed an encounter."
+    pre_scored = (
+        "The rubric has been pre-scored by automatic keyword matching in the submission that follows. Use the score as your "
+        "starting point and do not invent new criteria, but where the student's own words clearly contradict it (a point "
+        "marked NOT COVERED or MISSED that was in fact addressed, or the reverse), say so and explain why."
+    )
+    instructions = "Write only this section, in markdown, without a section title."
+    shared = f"""
+        {examiner} {pre_scored}
+        - **Patient's True Diagnosis:** {scenario['true_diagnosis']}"""
+
+    return {
+        "Differential Diagnosis Evaluation": f"""{shared}
+        --- DISCORDANT FEATURES FROM THE EXPERT RUBRIC ---
+        {discordant_str}
         ---
-        --- EXPERT ASSESSMENT RUBRIC (Your Answer Key) ---
-        **Expert Differential Diagnosis Analysis:**
-        {ddx_rubric_str}
-        **Expert Management Plan Analysis:**
-        {plan_rubric_str}
+        **YOUR TASK:** Evaluate the student's differential diagnosis. {instructions}
+        -   Did they identify the most likely diagnoses, in a sensible order?
+        -   Assess their reasoning. Did they cite the correct features from the case, as outlined in the rubric?
+        """,
+        "Management Plan Evaluation": f"""{shared}
         ---
-        **YOUR TASK:**
-        Provide structured, constructive feedback in markdown format by **strictly comparing the student's submission to the Expert Assessment Rubric**. Do not invent new criteria.
-        1.  **Differential Diagnosis Evaluation:**
-            -   Compare the student's DDx list to the expert rubric. Did they identify the most likely diagnoses?
-            -   Assess their reasoning. Did they cite the correct features from the case, as outlined in the rubric?
-        2.  **Management Plan Evaluation:**
-            -   Does the student's plan align with the 'Key Treatment Principles' (e.g., modified compression)?
-            -   Did it address the 'Goals of Care' and 'Plan of Care Considerations' (e.g., non-adherence, referrals)?
-        3.  **History Taking & Physical Exam Performance:**
-            -   Briefly comment on the student's interaction. Did they ask key questions (e.g., claudication, medication adherence)? Did they perform key exams (e.g., pulses, JVP)?
-        4.  **Overall Summary & Key Learning Points:**
-            -   Provide a final summary of what was done well and the most important learning points.
-        """
-    else: # Fallback prompt if no rubric exists
-        feedback_prompt = f"""
-        You are an expert OSCE examiner reviewing a medical student's performance.
-        The student has just completed an encounter with a simulated patient.
-        PATIENT'S TRUE DIAGNOSIS: {scenario['true_diagnosis']}
-        Here is the full transcript of the encounter:
-        --- TRANSCRIPT START ---
-        {transcript}
-        --- TRANSCRIPT END ---
-        After the encounter, the student provided the following assessment:
-        --- STUDENT'S DIFFERENTIAL DIAGNOSIS ---
+        **YOUR TASK:** Evaluate the student's management plan. {instructions}
+        -   Does the student's plan align with the 'Key Treatment Principles' (e.g., modified compression)?
+        -   Did it address the 'Goals of Care' and 'Plan of Care Considerations' (e.g., non-adherence, referrals)?
+        """,
+        "History Taking & Physical Exam Performance": f"""{shared}
+        ---
+        **YOUR TASK:** Evaluate the student's history taking and physical exam. {instructions}
+        -   Briefly comment on the student's interaction. Did they ask key questions (e.g., claudication, medication adherence)? Did they perform key exams (e.g., pulses, JVP)?
+        """,
+        "Overall Summary & Key Learning Points": f"""{shared}
+        ---
+        **YOUR TASK:** {instructions}
+        -   Provide a final summary of what was done well and the most important learning points.
+        """,
+    }
+
+def compile_prompt(prefix):
+    """Fixes the static prefix of a prompt along with its fingerprint and token count."""
+    return PromptTemplate(prefix, hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16], count_tokens(prefix))
+
+@st.cache_resource
+def get_scenario_prompts(scenario_id):
+    """Renders the static prefixes of a scenario's patient and examiner prompts once.
+
+    Returns a PromptTemplate for "patient" and for each feedback section title.
+    The prefixes are sent first in every request, so repeated calls can hit the
+    provider's prefix cache; only the per-session parts are added at call time.
+    """
+    scenario = load_scenario(scenario_id)
+    prompts = {"patient": compile_prompt(patient_persona_prompt(scenario))}
+    for title, prefix in examiner_prompt_prefixes(scenario).items():
+        prompts[title] = compile_prompt(prefix)
+    return prompts
+
+def build_feedback_section_prompts(scenario_id, transcript, actions, ddx, plan, score):
+    """Builds one independent examiner prompt per feedback section.
+
+    Each section only receives the part of the submission it grades and the
+    matching part of the locally computed rubric score, so the examiner writes
+    the narrative rather than re-grading the rubric. Returns a (static prefix,
+    submission) pair per section.
+    """
+    prompts = get_scenario_prompts(scenario_id)
+    actions_str = ", ".join(actions) if actions else "None"
+    section_scores = score["section_scores"]
+
+    submissions = {
+        "Differential Diagnosis Evaluation": f"""
+        **Student's Differential Diagnosis:**
         {ddx}
-        --- STUDENT'S MANAGEMENT PLAN ---
+        --- RUBRIC SCORE: DIFFERENTIAL DIAGNOSIS ({section_scores['differential_diagnosis']:.0%} of expert diagnoses named) ---
+        {format_ddx_score(score)}
+        """,
+        "Management Plan Evaluation": f"""
+        **Student's Management Plan:**
         {plan}
-        ---
-        Your task is to provide structured, constructive feedback in markdown format on:
-        1. History Taking, 2. Physical Exam & Investigations, 3. Differential Diagnosis, 4. Management Plan, 5. Overall Summary & Key Learning Points.
-        """
-    
-    try:
-        feedback_completion = st.session_state.groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": feedback_prompt}],
-            model="llama3-70b-8192", # Larger model for better analysis
-            temperature=0.5,
-            max_tokens=2048,
+        --- RUBRIC SCORE: MANAGEMENT PLAN ({section_scores['management_plan']:.0%} of rubric points covered) ---
+        {format_plan_score(score)}
+        """,
+        "History Taking & Physical Exam Performance": f"""
+        - **Full Encounter Transcript:** \n{transcript}
+        - **Exams, Labs and Referrals Ordered:** {actions_str}
+        --- RUBRIC SCORE: KEY EXAMS AND INVESTIGATIONS ({section_scores['key_actions']:.0%} performed) ---
+        {format_actions_score(score)}
+        """,
+        "Overall Summary & Key Learning Points": f"""
+        --- RUBRIC SCORE SUMMARY (overall {score['overall']:.0%}) ---
+        - Differential diagnosis: {section_scores['differential_diagnosis']:.0%} of expert diagnoses named
+        - Management plan: {section_scores['management_plan']:.0%} of rubric points covered
+        - Key exams and investigations: {section_scores['key_actions']:.0%} performed
+        {format_ddx_score(score)}
+        {format_actions_score(score)}
+        """,
+    }
+    return {title: (prompts[title].prefix, submission) for title, submission in submissions.items()}
+
+def format_transcript(events):
+    """Formats the chat turns of an encounter, without actions, for grading."""
+    return "\n".join([f"{event.key}: {event.content}" for event in events if event.kind == "chat"])
+
+def performed_actions(events):
+    """Returns the exams, investigations and referrals ordered, in order."""
+    return [event.key for event in events if event.kind == "action"]
+
+def feedback_section_request(prefix, submission):
+    """Returns the chat completion parameters for one feedback section.
+
+    The static prefix goes first, as the system message, so it can be served
+    from the provider's prefix cache.
+    """
+    return {
+        "messages": [{"role": "system", "content": prefix}, {"role": "user", "content": submission}],
+        "temperature": 0.5,
+        "max_tokens": FEEDBACK_SECTION_MAX_TOKENS,
+    }
+
+def stream_feedback_section(groq_backend, session_id, scenario_id, title, prompt, events):
+    """Streams one feedback section from a worker thread into the event queue.
+
+    Puts (title, token, None) for each token and (title, None, error) when done.
+    A section cut off mid-stream is requested again after an empty token, within
+    the time budget of a single feedback call.
+    """
+    deadline = llm_deadline("feedback")
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            call = new_llm_call("feedback", session_id, scenario_id)
+            stream = llm_stream(groq_backend, call, deadline, **feedback_section_request(*prompt))
+            for token in stream:
+                events.put((title, token, None))
+            break
+        except ConnectionError as e:
+            if attempt == LLM_MAX_RETRIES or time.monotonic() >= deadline:
+                events.put((title, None, e))
+                return
+            events.put((title, "", None))
+        except Exception as e:
+            events.put((title, None, e))
+            return
+    events.put((title, None, None))
+
+@st.cache_resource
+def get_feedback_executor():
+    """Creates the worker pool shared by all sessions for feedback sections."""
+    return ThreadPoolExecutor(max_workers=FEEDBACK_MAX_WORKERS, thread_name_prefix="feedback")
+
+def generate_feedback(ddx, plan, score_placeholder, placeholders):
+    """Asks the AI to generate feedback on the user's performance.
+
+    The sections are requested concurrently and streamed into their placeholders
+    as tokens arrive, so the wait is bounded by the slowest section.
+    """
+    scenario = st.session_state.current_scenario
+    transcript = format_transcript(st.session_state.events)
+    actions = performed_actions(st.session_state.events)
+    score = score_submission(scenario, ddx, plan, transcript, actions)
+    st.session_state.rubric_score = score
+    render_rubric_score(score, score_placeholder)
+    prompts = build_feedback_section_prompts(st.session_state.scenario_key, transcript, actions, ddx, plan, score)
+
+    feedback = {title: "" for title in prompts}
+    events = queue.Queue()
+    executor = get_feedback_executor()
+    for title, prompt in prompts.items():
+        executor.submit(
+            stream_feedback_section, st.session_state.groq_backend, st.session_state.session_id,
+            st.session_state.scenario_key, title, prompt, events,
         )
-        st.session_state.feedback = feedback_completion.choices[0].message.content
-    except Exception as e:
-        st.session_state.feedback = f"Error generating feedback: {e}"
+
+    pending = len(prompts)
+    while pending:
+        title, token, error = events.get()
+        if token == "":
+            feedback[title] = ""
+            placeholders[title].markdown("_Waiting for the examiner..._")
+            continue
+        if token is not None:
+            feedback[title] += token
+            placeholders[title].markdown(feedback[title] + "▌")
+            continue
+        pending -= 1
+        if error is not None:
+            separator = "\n\n" if feedback[title] else ""
+            feedback[title] += f"{separator}Error generating this section: {error}"
+        placeholders[title].markdown(feedback[title])
+    st.session_state.feedback = feedback
+    save_encounter_stats(score)
+    save_encounter_event("feedback", {"sections": feedback, "rubric_score": score}, "completed")
+
+def render_rubric_score(score, container):
+    """Displays the locally computed rubric score."""
+    with container:
+        st.subheader("Rubric Score")
+        overall_col, ddx_col, plan_col, actions_col = st.columns(4)
+        overall_col.metric("Overall", f"{score['overall']:.0%}")
+        ddx_col.metric("Differential Diagnosis", f"{score['section_scores']['differential_diagnosis']:.0%}")
+        plan_col.metric("Management Plan", f"{score['section_scores']['management_plan']:.0%}")
+        actions_col.metric("Key Exams & Investigations", f"{score['section_scores']['key_actions']:.0%}")
+        with st.expander("Rubric details"):
+            st.markdown("**Differential Diagnosis**")
+            st.markdown(format_ddx_score(score))
+            st.markdown("**Management Plan**")
+            st.markdown(format_plan_score(score))
+            st.markdown("**Exams & Investigations**")
+            st.markdown(format_actions_score(score))
 
 def render_feedback():
-    """Displays the final feedback."""
+    """Displays the final feedback, generating it first if needed."""
     st.title("OSCE Performance Feedback")
-    st.markdown(st.session_state.feedback)
-    
+
+    score_placeholder = st.container()
+    placeholders = {}
+    for title in FEEDBACK_SECTIONS:
+        st.subheader(title)
+        placeholders[title] = st.empty()
+
+    if not st.session_state.feedback:
+        for placeholder in placeholders.values():
+            placeholder.markdown("_Waiting for the examiner..._")
+        generate_feedback(st.session_state.submission["ddx"], st.session_state.submission["plan"], score_placeholder, placeholders)
+    else:
+        render_rubric_score(st.session_state.rubric_score, score_placeholder)
+        for title, text in st.session_state.feedback.items():
+            placeholders[title].markdown(text)
+
     if st.button("Return to Scenario Selection", use_container_width=True):
         st.session_state.page = "scenario_selection"
         # Clear specific encounter data but keep the client
-        st.session_state.current_scenario = None
-        st.session_state.conversation_history = []
-        st.session_state.results = []
-        st.session_state.encounter_active = False
-        st.session_state.start_time = 0
-        st.session_state.feedback = ""
+        reset_encounter_state()
         st.rerun()
 
 # --- MAIN APP LOGIC ---
 
-# Set page config for wide mode
-st.set_page_config(layout="wide", page_title="Modern OSCE Simulator")
-
-# Initialize state on first run
-initialize_state()
-
-# Page router
-if st.session_state.page == "api_key_entry":
-    render_api_key_entry()
-elif st.session_state.page == "scenario_selection":
-    render_scenario_selection()
-elif st.session_state.page == "main_encounter":
-    render_main_encounter()
-elif st.session_state.page == "assessment":
-    render_assessment()
-elif st.session_state.page == "feedback":
-    render_feedback()
\ No newline at end of file
+def main():
+    """Runs one pass of the Streamlit app."""
+    # Set page config for wide mode
+    st.set_page_config(layout="wide", page_title="Modern OSCE Simulator")
+
+    # Initialize state on first run
+    initialize_state()
+
+    if LLM_METRICS_PORT:
+        start_metrics_server(LLM_METRICS_HOST, LLM_METRICS_PORT)
+
+    # Page router
+    if st.session_state.page == "api_key_entry":
+        render_api_key_entry()
+    elif st.session_state.page == "scenario_selection":
+        render_scenario_selection()
+    elif st.session_state.page == "main_encounter":
+        render_main_encounter()
+    elif st.session_state.page == "assessment":
+        render_assessment()
+    elif st.session_state.page == "feedback":
+        render_feedback()
+    elif st.session_state.page == "analytics":
+        render_analytics()
+
+# Streamlit runs this file as __main__; other tools import it for its helpers
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+import streamlit.logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# The app's caches warn about the missing Streamlit server for every function
+streamlit.logger.set_log_level("error")
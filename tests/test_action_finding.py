@@ -0,0 +1,23 @@
+import streamlit_osce_app as app
+
+SCENARIO = {"lab_results": {"Order ABI": "ABI is 0.6."}, "physical_exam": {}, "referrals": {}}
+
+
+def action(key, category):
+    return app.EncounterEvent("action", key, 0.0, category)
+
+
+def test_finding_of_a_scenario_action():
+    assert app.action_finding(SCENARIO, action("Order ABI", "lab_results")) == "ABI is 0.6."
+
+
+def test_action_removed_from_the_scenario_has_no_finding():
+    assert app.action_finding(SCENARIO, action("Order Removed Test", "lab_results")) is None
+
+
+def test_action_from_a_section_the_scenario_no_longer_has():
+    assert app.action_finding({"physical_exam": {}}, action("Order ABI", "lab_results")) is None
+
+
+def test_action_without_a_category_has_no_finding():
+    assert app.action_finding(SCENARIO, action("Order ABI", None)) is None
@@ -0,0 +1,16 @@
+import streamlit_osce_app as app
+
+
+def test_repeated_actions_are_listed_once_in_order():
+    events = [
+        app.EncounterEvent("action", "Order ABI", 0.0, "lab_results"),
+        app.chat_event("user", "Do you smoke?"),
+        app.EncounterEvent("action", "Check pulses", 0.0, "physical_exam"),
+        app.EncounterEvent("action", "Order ABI", 0.0, "lab_results"),
+        app.EncounterEvent("action", "Order ABI", 0.0, "lab_results"),
+    ]
+
+    messages = app.build_context_messages("You are the patient.", events)
+    actions_line = next(message["content"] for message in messages if "Actions performed" in message["content"])
+
+    assert actions_line.endswith(": Order ABI, Check pulses")
@@ -0,0 +1,20 @@
+import pytest
+
+import llm_client
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        llm_client.LLMBackend(None, None, None)
+
+
+def test_backend_must_implement_list_models():
+    class ChatOnlyBackend(llm_client.LLMBackend):
+        def create(self, request, timeout):
+            return None
+
+        async def acreate(self, request, timeout):
+            return None
+
+    with pytest.raises(TypeError, match="list_models"):
+        ChatOnlyBackend(None, None, None)
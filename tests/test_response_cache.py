@@ -0,0 +1,33 @@
+import streamlit_osce_app as app
+
+
+def make_cache():
+    return app.ResponseCache(max_entries=10, ttl=60, similarity=app.RESPONSE_CACHE_SIMILARITY)
+
+
+def test_question_with_another_content_word_is_a_miss():
+    cache = make_cache()
+    cache.put("scenario", "digest", app.normalize_question("Did your mother have diabetes?"), "Yes, my mother had diabetes.")
+
+    assert cache.get("scenario", "digest", app.normalize_question("Did your father have diabetes?")) is None
+
+
+def test_question_differing_only_in_stopwords_shares_the_reply():
+    cache = make_cache()
+    cache.put("scenario", "digest", app.normalize_question("Does your mother have diabetes?"), "Yes, my mother had diabetes.")
+
+    assert cache.get("scenario", "digest", app.normalize_question("Did your mother have diabetes?")) == "Yes, my mother had diabetes."
+
+
+def test_filler_and_punctuation_are_ignored():
+    cache = make_cache()
+    cache.put("scenario", "digest", app.normalize_question("Do you smoke?"), "No, I quit years ago.")
+
+    assert cache.get("scenario", "digest", app.normalize_question("So, um, do you smoke")) == "No, I quit years ago."
+
+
+def test_other_context_is_a_miss():
+    cache = make_cache()
+    cache.put("scenario", "digest", app.normalize_question("Do you smoke?"), "No, I quit years ago.")
+
+    assert cache.get("scenario", "other", app.normalize_question("Do you smoke?")) is None
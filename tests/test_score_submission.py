@@ -0,0 +1,58 @@
+import pytest
+
+import streamlit_osce_app as app
+
+SCENARIO = "mr_smith_leg_ulcer"
+MIXED = "Mixed Arterial-Venous Leg Ulcer"
+ARTERIAL = "Arterial Insufficiency Ulcer"
+VENOUS = "Venous Stasis Ulcer"
+DIABETIC = "Diabetic (Neuropathic) Ulcer"
+
+
+def score(ddx="", plan=""):
+    return app.score_submission(app.load_scenario(SCENARIO), ddx, plan, "", [])
+
+
+def named(result):
+    return {d["diagnosis"] for d in result["diagnoses"] if d["named"]}
+
+
+def covered(result):
+    return {app.rubric_point_label(p["point"]) for p in result["plan_points"] if p["covered"]}
+
+
+@pytest.mark.parametrize("ddx, expected", [
+    ("Arterial ulcer - no palpable pulses", {ARTERIAL}),
+    ("Venous stasis ulcer without infection", {VENOUS}),
+    ("Venous ulcer (no DVT on duplex)", {VENOUS}),
+    ("Arterial insufficiency ulcer: absent pulses, no hair growth", {ARTERIAL}),
+    ("Mixed arterial venous ulcer", {MIXED}),
+    ("1. Mixed ulcer\n2. Arterial ulcer\n3. Diabetic foot ulcer", {MIXED, ARTERIAL, DIABETIC}),
+    ("Not a venous ulcer", set()),
+    ("Venous ulcer unlikely", set()),
+    ("DVT ruled out; arterial ulcer", {ARTERIAL}),
+    ("Ruled out venous ulcer", set()),
+])
+def test_ddx_diagnoses_named(ddx, expected):
+    assert named(score(ddx=ddx)) == expected
+
+
+def test_ddx_rank_follows_the_students_order():
+    result = score(ddx="Diabetic ulcer; arterial ulcer")
+    ranks = {d["diagnosis"]: d["student_rank"] for d in result["diagnoses"]}
+
+    assert ranks[DIABETIC] == 1
+    assert ranks[ARTERIAL] == 2
+
+
+@pytest.mark.parametrize("plan, point, expected", [
+    ("Modified compression therapy", "First-Line Therapy", True),
+    ("No compression", "First-Line Therapy", False),
+    ("Defer sharp debridement for now", "Initial Management", True),
+    ("No sharp debridement", "Initial Management", True),
+    ("Refer to wound care if no improvement", "Interdisciplinary Team", True),
+    ("Do not involve family", "Family/Social Support", False),
+    ("Address non-adherence to furosemide and lisinopril", "Adherence", True),
+])
+def test_plan_points_covered(plan, point, expected):
+    assert (point in covered(score(plan=plan))) is expected
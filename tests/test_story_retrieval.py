@@ -0,0 +1,33 @@
+import pytest
+
+import streamlit_osce_app as app
+
+SCENARIO = "mr_smith_leg_ulcer"
+
+
+def facts_for(*questions):
+    events = [app.chat_event("user", question) for question in questions]
+    return app.retrieve_story_facts(SCENARIO, events)
+
+
+def test_diabetic_and_diabetes_share_a_stem():
+    assert app.stem("diabetic") == app.stem("diabetes")
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("Are you diabetic?", "Type 2 Diabetes"),
+    ("Have you had any surgeries?", "CABG surgery"),
+    ("Any swelling?", "shoes feel tighter"),
+    ("Do you smoke?", "50-pack-year"),
+])
+def test_history_questions_retrieve_their_fact(question, expected):
+    facts = facts_for(question)
+
+    assert any(expected in fact for fact in facts)
+    assert len(facts) <= app.STORY_FACTS_TOP_K
+
+
+def test_unmatched_question_gets_the_whole_story():
+    story = app.split_story_facts(app.load_scenario(SCENARIO)["patient_story"])
+
+    assert facts_for("Do you have any allergies?") == story